@@ -1,11 +1,37 @@
 import logging
 from fastapi import FastAPI
+from db import pool_stats
+from metrics import metrics_response, record_request
+from profiling import profile_request
 from game.endpoints import router as game_router
 from users.endpoints import router as user_router
 from questions.endpoints import questions_router
+from questions.opentdb import client as open_trivia
 
 
 app = FastAPI()
+app.middleware("http")(profile_request)
+app.middleware("http")(record_request)
 app.include_router(user_router)
 app.include_router(questions_router)
 app.include_router(game_router)
+
+
+@app.on_event("startup")
+async def startup():
+    await open_trivia.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await open_trivia.close()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+
+@app.get("/db/stats", include_in_schema=False)
+async def db_stats():
+    return pool_stats()
@@ -1,22 +1,68 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import metrics
+import profiling
 from settings import get_settings
 
 settings = get_settings()
-print(settings.DB_USER, settings.DB_PASSWORD, settings.DB_HOST, settings.DB_PORT, settings.DB_NAME)
+DB_POOL_SIZE = int(settings.DB_POOL_SIZE)
+DB_MAX_OVERFLOW = int(settings.DB_MAX_OVERFLOW)
+DB_STATEMENT_CACHE_SIZE = int(settings.DB_STATEMENT_CACHE_SIZE)
+# Arbitrary key of the advisory lock schema changes are made under
+SCHEMA_LOCK_ID = 7212
 
+# The statement cache size is applied to both asyncpg and SQLAlchemy's
+# prepared statement cache, 0 disables both for use behind pgbouncer
 DB_URL = f"postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PASSWORD}" \
-    f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
+    f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}" \
+    f"?prepared_statement_cache_size={DB_STATEMENT_CACHE_SIZE}"
 
-engine = create_async_engine(DB_URL)
+engine = create_async_engine(
+    DB_URL,
+    poolclass=metrics.InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=float(settings.DB_POOL_TIMEOUT),
+    pool_recycle=int(settings.DB_POOL_RECYCLE),
+    pool_pre_ping=True,
+    connect_args={'statement_cache_size': DB_STATEMENT_CACHE_SIZE}
+)
+metrics.instrument_engine(engine)
+profiling.instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
 Base = declarative_base()
 
 
+async def lock_schema(conn: AsyncConnection):
+    # Every worker creates and upgrades the tables at startup, the lock makes
+    # them take turns instead of racing each other's DDL. It is released when
+    # the transaction ends
+    await conn.execute(text('SELECT pg_advisory_xact_lock(:id)'), {'id': SCHEMA_LOCK_ID})
+
+
+def pool_stats() -> dict:
+    # Every worker has its own pool, so a deployment can hold up to
+    # workers * capacity connections against Postgres' max_connections
+    pool = engine.sync_engine.pool
+    capacity = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'capacity': capacity,
+        'checked_out': pool.checkedout(),
+        'idle': pool.checkedin(),
+        'overflow': max(0, pool.overflow()),
+        'saturation': pool.checkedout() / capacity
+    }
+
+
 async def get_db() -> AsyncSession:
+    # A session only checks out a connection when its first statement runs,
+    # so requests rejected before reaching the database never touch the pool
     db = SessionLocal()
     try:
         yield db
     finally:
-        await db.close()
\ No newline at end of file
+        await db.close()
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import os
+import random
+import time
+from users.session import redis
+from settings import get_settings
+
+
+settings = get_settings()
+CODE_COOLDOWN = int(settings.JOINING_CODE_COOLDOWN)
+REFILL_INTERVAL = int(settings.JOINING_CODE_REFILL_INTERVAL)
+
+with open(os.path.join(os.path.dirname(__file__), "docker_names.json")) as f:
+    docker_names = json.load(f)
+    LEFT_NAMES = docker_names["left"]
+    RIGHT_NAMES = docker_names["right"]
+ALL_CODES = frozenset(f"{left}-{right}" for left in LEFT_NAMES for right in RIGHT_NAMES)
+
+FREE_KEY = 'joining-codes/free'
+COOLING_KEY = 'joining-codes/cooling'
+INITIALIZED_KEY = 'joining-codes/initialized'
+ALLOCATED_KEY = 'joining-codes/allocated'
+DEPLETED_KEY = 'joining-codes/depleted'
+
+# Moves codes whose cooldown has passed back into the free pool
+REFILL_SCRIPT = """
+local codes = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #codes > 0 then
+    redis.call('SADD', KEYS[2], unpack(codes))
+    redis.call('ZREM', KEYS[1], unpack(codes))
+end
+return #codes
+"""
+refill_script = redis.register_script(REFILL_SCRIPT)
+
+
+async def initialize(active_codes: list[str]):
+    if not await redis.set(INITIALIZED_KEY, 1, nx=True):
+        return
+    codes = list(ALL_CODES - set(active_codes))
+    random.shuffle(codes)
+    async with redis.pipeline(transaction=False) as pipe:
+        for i in range(0, len(codes), 1000):
+            pipe.sadd(FREE_KEY, *codes[i:i + 1000])
+        await pipe.execute()
+
+
+async def allocate() -> str:
+    code = await redis.spop(FREE_KEY)
+    if code is None:
+        await redis.incr(DEPLETED_KEY)
+        await refill()
+        code = await redis.spop(FREE_KEY)
+    await redis.incr(ALLOCATED_KEY)
+    if code is None:
+        # Every code is in use, fall back to a suffixed code outside of the pool
+        return f"{random.choice(LEFT_NAMES)}-{random.choice(RIGHT_NAMES)}-{random.randint(1000, 9999)}"
+    return code.decode()
+
+
+async def release(*codes: str):
+    # Codes cool down before reuse so that leftover state for the old game can expire
+    available_at = time.time() + CODE_COOLDOWN
+    codes = {code: available_at for code in codes if code in ALL_CODES}
+    if codes:
+        await redis.zadd(COOLING_KEY, codes)
+
+
+async def refill() -> int:
+    return await refill_script(keys=[COOLING_KEY, FREE_KEY], args=[time.time(), 1000])
+
+
+async def refill_forever():
+    while True:
+        await refill()
+        await asyncio.sleep(REFILL_INTERVAL)
+
+
+async def stats() -> dict:
+    async with redis.pipeline(transaction=False) as pipe:
+        free, cooling, allocated, depleted = await pipe.scard(FREE_KEY).zcard(COOLING_KEY) \
+            .get(ALLOCATED_KEY).get(DEPLETED_KEY).execute()
+    return {
+        'free': free,
+        'cooling': cooling,
+        'allocated': int(allocated or 0),
+        'depleted': int(depleted or 0)
+    }
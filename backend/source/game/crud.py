@@ -1,166 +1,340 @@
-import os
-import json
-import random
-import requests
+import logging
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from game import models, schemas, errors
-from users.crud import get_user_by_id
+from sqlalchemy import exists, literal, select
+from game import models, schemas, errors, listing, lobby, codes, engine
+from questions import buffer
+from questions.errors import OpenTriviaUnavailable
+from questions.opentdb import client as open_trivia
+from users.crud import get_users_by_ids
 
 
-with open(os.path.join(os.path.dirname(__file__), "docker_names.json")) as f:
-    docker_names = json.load(f)
-    LEFT_NAMES = docker_names["left"]
-    RIGHT_NAMES = docker_names["right"]
+logger = logging.getLogger(__name__)
+CREATE_GAME_ATTEMPTS = 5
 
 
-async def get_active_games(db: AsyncSession):
-    active_games = await db.execute(models.Game.__table__.select().where(models.Game.is_active == True))
-    active_games = active_games.all()
-    return [
-        schemas.Game(
-            host_player=game.host_id,
-            max_players=game.max_players,
-            is_started=game.is_started,
-            is_active=game.is_active,
-            player_count=len(game.players),
-            host_player_object = await get_user_by_id(db, game.host_id)
-        ) for game in active_games
-    ]
+async def get_game_record(db: AsyncSession, joining_code: str):
+    # Joining codes are reused once a game ends, the latest game owns the code
+    game = await db.execute(
+        models.Game.__table__.select()
+        .where(models.Game.joining_code == joining_code)
+        .order_by(models.Game.id.desc())
+        .limit(1)
+    )
+    return game.first()
 
 
-async def get_game(db: AsyncSession, joining_code: str):
-    game = await db.execute(models.Game.__table__.select().where(models.Game.joining_code == joining_code))
-    game = game.first()
-    if game is None:
-        raise errors.GameNotFound(joining_code)
+async def get_players(db: AsyncSession, game_id: int):
+    # Only the membership comes from the DB, the profiles are usually cached
+    user_ids = await db.execute(
+        select(models.GamePlayer.user_id)
+        .where(models.GamePlayer.game_id == game_id)
+        .order_by(models.GamePlayer.joined_at)
+    )
+    user_ids = user_ids.scalars().all()
+    users = await get_users_by_ids(db, user_ids)
+    return [users[user_id] for user_id in user_ids]
+
+
+async def is_player(db: AsyncSession, game_id: int, user_id: int):
+    result = await db.execute(
+        select(exists().where(models.GamePlayer.game_id == game_id, models.GamePlayer.user_id == user_id))
+    )
+    return result.scalar()
+
+
+async def _joined_game(db: AsyncSession, game):
     return schemas.JoinedGame(
-        joining_code=joining_code,
+        joining_code=game.joining_code,
         host_player=game.host_id,
         max_players=game.max_players,
         is_started=game.is_started,
         is_active=game.is_active,
-        players=[await get_user_by_id(db, int(player_id)) for player_id in game.players]
+        players=await get_players(db, game.id)
     )
 
-async def create_game(db: AsyncSession, host_id: int, max_players: int):
-    left = random.choice(LEFT_NAMES)
-    right = random.choice(RIGHT_NAMES)
-    joining_code = f"{left}-{right}"
-
-    open_trivia_url = 'https://opentdb.com/api_token.php'
-    open_trivia_params = {
-        'command': 'request',
-    }
-    open_trivia_response = requests.get(open_trivia_url, params=open_trivia_params)
-    open_trivia_token = open_trivia_response.json()['token']
-
-    game = models.Game(
-        joining_code=joining_code,
-        host_id=host_id,
-        players=[host_id],
-        max_players=max_players,
-        is_started=False,
-        is_active=True,
-        winner=None,
-        open_trivia_token=open_trivia_token
+
+async def get_active_games(db: AsyncSession, after: int | None = None, limit: int = 50, joinable: bool = False):
+    cache_key, page = await listing.get_cached_page(after, limit, joinable)
+    if page is not None:
+        return page
+
+    query = models.Game.__table__.select().where(models.Game.is_active == True)
+    if after is not None:
+        query = query.where(models.Game.id > after)
+    if joinable:
+        query = query.where(models.Game.is_started == False).where(
+            models.Game.player_count < models.Game.max_players
+        )
+    active_games = await db.execute(query.order_by(models.Game.id).limit(limit))
+    active_games = active_games.all()
+    hosts = await get_users_by_ids(db, [game.host_id for game in active_games])
+    page = schemas.GamePage(
+        games=[
+            schemas.Game(
+                joining_code=game.joining_code,
+                host_player=game.host_id,
+                max_players=game.max_players,
+                is_started=game.is_started,
+                is_active=game.is_active,
+                player_count=game.player_count,
+                host_player_object=hosts[game.host_id]
+            ) for game in active_games
+        ],
+        next_after=active_games[-1].id if len(active_games) == limit else None
     )
-    db.add(game)
+    await listing.store_page(cache_key, page)
+    return page
+
+
+async def get_game(db: AsyncSession, joining_code: str):
+    game = await get_game_record(db, joining_code)
+    if game is None:
+        raise errors.GameNotFound(joining_code)
+    return await _joined_game(db, game)
+
+async def create_game(db: AsyncSession, host_id: int, max_players: int):
+    open_trivia_token = await open_trivia.request_token()
+    for _ in range(CREATE_GAME_ATTEMPTS):
+        joining_code = await codes.allocate()
+        game = models.Game(
+            joining_code=joining_code,
+            host_id=host_id,
+            max_players=max_players,
+            player_count=1,
+            is_started=False,
+            is_active=True,
+            winner=None,
+            open_trivia_token=open_trivia_token
+        )
+        db.add(game)
+        try:
+            await db.flush()
+            break
+        except IntegrityError:
+            # Only a fallback code from outside the pool can still belong to
+            # an active game, another one is drawn
+            await db.rollback()
+    else:
+        raise errors.NoJoiningCodeAvailable
+    # Read before the commit expires it, reloading it would need another query
+    game_id = game.id
+    db.add(models.GamePlayer(game_id=game_id, user_id=host_id))
     await db.commit()
+    await listing.invalidate()
     return schemas.JoinedGame(
         joining_code=joining_code,
         host_player=host_id,
         max_players=max_players,
         is_started=False,
         is_active=True,
-        players=[await get_user_by_id(db, host_id)]
+        players=await get_players(db, game_id)
     )
 
 
 async def join_game(db: AsyncSession, joining_code: str, user_id: int):
-    game = await db.execute(models.Game.__table__.select().where(models.Game.joining_code == joining_code))
-    game = game.first()
+    game = await get_game_record(db, joining_code)
     if not game:
         raise errors.GameNotFound(joining_code)
     if game.is_started:
         raise errors.GameAlreadyStarted
-    if user_id in game.players:
+    if await is_player(db, game.id, user_id):
         raise errors.UserAlreadyInGame
-    if len(game.players) >= game.max_players:
-        raise errors.GameAlreadyFull
-    await db.execute(models.Game.__table__.update().where(models.Game.joining_code == joining_code).values(players=game.players + [user_id]))
-    await db.commit()
-    return schemas.JoinedGame(
-        joining_code=joining_code,
-        host_player=game.host_id,
-        max_players=game.max_players,
-        is_started=game.is_started,
-        is_active=game.is_active,
-        players=[await get_user_by_id(db, int(player_id)) for player_id in game.players]
+
+    # Taking a seat and adding the membership is one statement, so the
+    # capacity and not-started checks hold under concurrent joins
+    seat = (
+        models.Game.__table__.update()
+        .where(models.Game.id == game.id)
+        .where(models.Game.is_started == False)
+        .where(models.Game.player_count < models.Game.max_players)
+        .values(player_count=models.Game.player_count + 1)
+        .returning(models.Game.id)
+        .cte('seat')
     )
+    try:
+        joined = await db.execute(
+            models.GamePlayer.__table__.insert()
+            .from_select(['game_id', 'user_id'], select(seat.c.id, literal(user_id)))
+            .add_cte(seat)
+            .returning(models.GamePlayer.game_id)
+        )
+        joined = joined.first()
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise errors.UserAlreadyInGame
+    if joined is None:
+        game = await get_game_record(db, joining_code)
+        if game.is_started:
+            raise errors.GameAlreadyStarted
+        raise errors.GameAlreadyFull
+    await listing.invalidate()
+    joined_game = await _joined_game(db, game)
+    user_name = next(player.user_name for player in joined_game.players if player.id == user_id)
+    await lobby.joined(joining_code, user_id, user_name)
+    return joined_game
 
 
 async def leave_game(db: AsyncSession, joining_code: str, user_id: int):
-    game = await db.execute(models.Game.__table__.select().where(models.Game.joining_code == joining_code))
-    game = game.first()
+    game = await get_game_record(db, joining_code)
     if not game:
         raise errors.GameNotFound(joining_code)
-    if user_id not in game.players:
-        raise errors.UserNotInGame
     if user_id == game.host_id:
         raise errors.UserIsHost
     if game.is_started:
         raise errors.GameAlreadyStarted
-    await db.execute(models.Game.__table__.update().where(models.Game.joining_code == joining_code).values(players=[player_id for player_id in game.players if player_id != user_id]))
-    await db.commit()
-    return schemas.JoinedGame(
-        joining_code=joining_code,
-        host_player=game.host_id,
-        max_players=game.max_players,
-        is_started=game.is_started,
-        is_active=game.is_active,
-        players=[await get_user_by_id(db, int(player_id)) for player_id in game.players]
+    removed = (
+        models.GamePlayer.__table__.delete()
+        .where(models.GamePlayer.game_id == game.id)
+        .where(models.GamePlayer.user_id == user_id)
+        .where(exists().where(models.Game.id == game.id, models.Game.is_started == False))
+        .returning(models.GamePlayer.game_id)
+        .cte('removed')
+    )
+    # The count only changes while the game is still not started, checked
+    # again once the game row is locked, so a leave racing start_game cannot
+    # change a started game's count
+    left = await db.execute(
+        models.Game.__table__.update()
+        .where(models.Game.id.in_(select(removed.c.game_id)))
+        .where(models.Game.is_started == False)
+        .values(player_count=models.Game.player_count - 1)
+        .add_cte(removed)
+        .returning(models.Game.id)
     )
+    left = left.first()
+    if left is None:
+        # Undoes the membership delete if the game started in between
+        await db.rollback()
+        game = await get_game_record(db, joining_code)
+        if game.is_started:
+            raise errors.GameAlreadyStarted
+        raise errors.UserNotInGame
+    await db.commit()
+    await listing.invalidate()
+    users = await get_users_by_ids(db, [user_id])
+    await lobby.left(joining_code, user_id, users[user_id].user_name)
+    return await _joined_game(db, game)
 
 
-async def start_game(db: AsyncSession, joining_code: str, user_id: int):
-    game = await db.execute(models.Game.__table__.select().where(models.Game.joining_code == joining_code))
-    game = game.first()
+async def start_game(db: AsyncSession, joining_code: str, user_id: int, deck: schemas.GameStart):
+    game = await get_game_record(db, joining_code)
     if not game:
         raise errors.GameNotFound(joining_code)
     if user_id != game.host_id:
         raise errors.UserNotHost
     if game.is_started:
         raise errors.GameAlreadyStarted
-    if len(game.players) < 2:
-        raise errors.NotEnoughPlayers
-    await db.execute(models.Game.__table__.update().where(models.Game.joining_code == joining_code).values(is_started=True))
+    started = await db.execute(
+        models.Game.__table__.update()
+        .where(models.Game.id == game.id)
+        .where(models.Game.is_started == False)
+        .where(models.Game.player_count >= 2)
+        .values(is_started=True)
+        .returning(*models.Game.__table__.c)
+    )
+    started = started.first()
     await db.commit()
-    return schemas.JoinedGame(
-        joining_code=joining_code,
-        host_player=game.host_id,
-        max_players=game.max_players,
-        is_started=game.is_started,
-        is_active=game.is_active,
-        players=[await get_user_by_id(db, int(player_id)) for player_id in game.players]
+    if started is None:
+        raise errors.NotEnoughPlayers
+    await listing.invalidate()
+    try:
+        await buffer.start(
+            joining_code,
+            deck.total_questions,
+            token=game.open_trivia_token,
+            category=deck.category,
+            difficulty=deck.difficulty
+        )
+    except OpenTriviaUnavailable:
+        # The game is already started and cannot be started again, so it
+        # plays on unbuffered and the question endpoint tops up or fetches
+        # each question directly instead
+        logger.exception('Buffering questions for game %s failed', joining_code)
+    joined_game = await _joined_game(db, started)
+    if engine.ENGINE_ENABLED:
+        await engine.create(
+            joining_code,
+            joined_game.players,
+            deck.total_questions,
+            token=game.open_trivia_token,
+            category=deck.category,
+            difficulty=deck.difficulty
+        )
+    # Announced last, so the lobby pages only move to the game once its
+    # questions are buffered and the engine is ready for them
+    await lobby.started(joining_code)
+    return joined_game
+
+
+async def cancel_game(db: AsyncSession, joining_code: str, user_id: int):
+    game = await get_game_record(db, joining_code)
+    if not game:
+        raise errors.GameNotFound(joining_code)
+    if user_id != game.host_id:
+        raise errors.UserNotHost
+    if game.is_started:
+        raise errors.GameAlreadyStarted
+    cancelled = await db.execute(
+        models.Game.__table__.update()
+        .where(models.Game.id == game.id)
+        .where(models.Game.is_started == False)
+        .where(models.Game.is_active == True)
+        .values(is_active=False)
+        .returning(models.Game.id)
     )
+    cancelled = cancelled.first()
+    await db.commit()
+    if cancelled is None:
+        raise errors.GameAlreadyEnded
+    await listing.invalidate()
+    await lobby.cancelled(joining_code)
+    await codes.release(joining_code)
+    return await _joined_game(db, game)
 
 
 async def end_game(db: AsyncSession, joining_code: str, user_id: int, winner: int):
-    game = await db.execute(models.Game.__table__.select().where(models.Game.joining_code == joining_code))
-    game = game.first()
+    game = await get_game_record(db, joining_code)
     if not game:
         raise errors.GameNotFound
     if user_id != game.host_id:
         raise errors.UserNotHost
-    if winner not in game.players:
+    if not await is_player(db, game.id, winner):
         raise errors.UserNotInGame
-    await db.execute(models.Game.__table__.update().where(models.Game.joining_code == joining_code).values(is_active=False, winner=winner))
-    await db.commit()
-    return schemas.JoinedGame(
-        joining_code=joining_code,
-        host_player=game.host_id,
-        max_players=game.max_players,
-        is_started=game.is_started,
-        is_active=game.is_active,
-        players=[await get_user_by_id(db, int(player_id)) for player_id in game.players]
+
+    # Ending the game and recording every player's result is one statement,
+    # so a game that is ended twice only has its results recorded once
+    ended = (
+        models.Game.__table__.update()
+        .where(models.Game.id == game.id)
+        .where(models.Game.is_active == True)
+        .values(is_active=False, winner=winner)
+        .returning(models.Game.id)
+        .cte('ended')
     )
+    recorded = await db.execute(
+        models.GameResult.__table__.insert()
+        .from_select(
+            ['game_id', 'user_id', 'is_winner', 'aggregated'],
+            # aggregated is selected explicitly, otherwise its Python side
+            # default is sent as NULL and overrides the server default
+            select(
+                models.GamePlayer.game_id,
+                models.GamePlayer.user_id,
+                models.GamePlayer.user_id == winner,
+                literal(False)
+            )
+            .where(models.GamePlayer.game_id.in_(select(ended.c.id)))
+        )
+        .add_cte(ended)
+        .returning(models.GameResult.id)
+    )
+    recorded = recorded.first()
+    await db.commit()
+    if recorded is not None:
+        await listing.invalidate()
+        await buffer.clear(joining_code)
+        await codes.release(joining_code)
+    ended_game = await db.execute(models.Game.__table__.select().where(models.Game.id == game.id))
+    return await _joined_game(db, ended_game.first())
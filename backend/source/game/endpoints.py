@@ -1,14 +1,16 @@
-from typing import List
-from aioredis import Redis
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from sqlalchemy import ARRAY, String, all_, bindparam
 from sqlalchemy.ext.asyncio import AsyncSession
-from users.session import validate_session, get_user_id
-from db import engine, get_db
-from game import crud, schemas, models, errors
+from users.errors import UserNotLoggedIn
+from users.session import redis, validate_session, get_user_id
+from db import SessionLocal, engine, get_db, lock_schema
+from game import crud, schemas, models, errors, codes, results, migrations, engine as game_engine
 from settings import get_settings
 
 
 settings = get_settings()
+background_tasks = set()
 
 
 router = APIRouter(
@@ -22,32 +24,50 @@ router = APIRouter(
 @router.on_event("startup")
 async def startup():
     async with engine.begin() as conn:
+        await lock_schema(conn)
         await conn.run_sync(models.Base.metadata.create_all)
-    
-    # See what games are in the DB and not in redis
-    # If they're not in redis, mark them as inactive
-    # If they're in redis, mark them as active
-
-    
-    redis = Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        password=settings.REDIS_PASSWORD,
-        db=settings.REDIS_DB
-    )
+        await migrations.upgrade(conn)
 
+    # Any game that is active in the DB but has no state in redis can no
+    # longer be played, so mark it as inactive
+    live_codes = [
+        key.decode()[len('games/'):] async for key in redis.scan_iter(match='games/*', count=1000)
+    ]
     async with engine.begin() as db:
-        active_games = await db.execute(models.Game.__table__.select().where(models.Game.is_active == True))
-        active_games = active_games.all()
-        games_in_redis = await redis.keys("games/*")
-        for game in active_games:
-            if game.joining_code not in games_in_redis:
-                await db.execute(models.Game.__table__.update().where(models.Game.id == game.id).values(is_active=False))
+        ended_games = await db.execute(
+            models.Game.__table__.update()
+            .where(models.Game.is_active == True)
+            .where(models.Game.joining_code != all_(bindparam('live_codes', live_codes, type_=ARRAY(String))))
+            .values(is_active=False)
+            .returning(models.Game.joining_code)
+        )
+        ended_codes = ended_games.scalars().all()
 
+    await codes.initialize(live_codes)
+    await codes.release(*ended_codes)
+    background_tasks.add(asyncio.create_task(codes.refill_forever()))
+    background_tasks.add(asyncio.create_task(results.aggregate_forever()))
 
-@router.get("/", response_model=List[schemas.Game])
-async def get_active_games(db: AsyncSession=Depends(get_db)):
-    return await crud.get_active_games(db)
+
+@router.on_event("shutdown")
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+
+
+@router.get("/", response_model=schemas.GamePage)
+async def get_active_games(
+    after: int | None = Query(default=None),
+    limit: int = Query(default=50, ge=1, le=100),
+    joinable: bool = Query(default=False),
+    db: AsyncSession=Depends(get_db)
+):
+    return await crud.get_active_games(db, after, limit, joinable)
+
+
+@router.get("/codes/stats")
+async def get_joining_code_stats():
+    return await codes.stats()
 
 
 @router.post("/", response_model=schemas.JoinedGame, status_code=status.HTTP_201_CREATED)
@@ -69,8 +89,8 @@ async def join_game(joining_code: str, user_id: int=Depends(get_user_id), db: As
 
 
 @router.post("/{joining_code}/start", response_model=schemas.JoinedGame)
-async def start_game(joining_code: str, user_id: int=Depends(get_user_id), db: AsyncSession=Depends(get_db)):
-    return await crud.start_game(db, joining_code, user_id)
+async def start_game(joining_code: str, deck: schemas.GameStart | None = None, user_id: int=Depends(get_user_id), db: AsyncSession=Depends(get_db)):
+    return await crud.start_game(db, joining_code, user_id, deck or schemas.GameStart())
 
 
 @router.post("/{joining_code}/leave", response_model=schemas.JoinedGame)
@@ -78,6 +98,53 @@ async def leave_game(joining_code: str, user_id: int=Depends(get_user_id), db: A
     return await crud.leave_game(db, joining_code, user_id)
 
 
+@router.post("/{joining_code}/cancel", response_model=schemas.JoinedGame)
+async def cancel_game(joining_code: str, user_id: int=Depends(get_user_id), db: AsyncSession=Depends(get_db)):
+    return await crud.cancel_game(db, joining_code, user_id)
+
+
 @router.post("/{joining_code}/end", response_model=schemas.JoinedGame)
 async def end_game(joining_code: str, results: schemas.GameEnd, user_id: int=Depends(get_user_id), db: AsyncSession=Depends(get_db)):
-    return await crud.end_game(db, joining_code, user_id, results.winner)
\ No newline at end of file
+    return await crud.end_game(db, joining_code, user_id, results.winner)
+
+
+# Router dependencies are not applied to websocket routes, so the session is
+# passed as a query parameter and checked here
+@router.websocket("/{joining_code}/play")
+async def play_game(websocket: WebSocket, joining_code: str, session_id: str = Query()):
+    if not game_engine.ENGINE_ENABLED:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    try:
+        user_id = await get_user_id(session_id)
+    except UserNotLoggedIn:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    async with SessionLocal() as db:
+        game = await crud.get_game_record(db, joining_code)
+        if game is None or not await crud.is_player(db, game.id, user_id):
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+    await websocket.accept()
+    try:
+        await game_engine.join_room(joining_code, websocket)
+        while True:
+            received = await websocket.receive()
+            if received['type'] == 'websocket.disconnect':
+                break
+            message = game_engine.parse_message(received.get('text'))
+            if message is None:
+                continue
+            if message['type'] == 'answer':
+                await game_engine.answer(joining_code, user_id, message['answer'], message['round'])
+            elif message['type'] == 'request-scores':
+                await websocket.send_json({'type': 'scores', 'scores': await game_engine.scores(joining_code)})
+            elif user_id == game.host_id and message['type'] == 'next-question':
+                await game_engine.next_question(joining_code, message['round'])
+            elif user_id == game.host_id and message['type'] == 'end-round':
+                await game_engine.end_round(joining_code)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        game_engine.leave_room(joining_code, websocket)
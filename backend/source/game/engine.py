@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+from fastapi import WebSocket
+from questions import buffer
+from questions.errors import OpenTriviaUnavailable
+from questions.opentdb import client as open_trivia
+from users.session import redis
+from settings import get_settings
+
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+ENGINE_ENABLED = settings.GAME_ENGINE_ENABLED == "1"
+ENGINE_TTL = 3600
+ROUND_SECONDS = int(settings.GAME_ENGINE_ROUND_SECONDS)
+LOCK_SECONDS = 10
+# The fallback question fetch runs under the room's lock, so it gives up well
+# before the lock could expire under it
+FETCH_SECONDS = LOCK_SECONDS / 2
+
+
+def _state_key(joining_code: str) -> str:
+    return f'engine/{joining_code}'
+
+
+def _scores_key(joining_code: str) -> str:
+    return f'engine/{joining_code}/scores'
+
+
+def _names_key(joining_code: str) -> str:
+    return f'engine/{joining_code}/names'
+
+
+def _answered_key(joining_code: str) -> str:
+    return f'engine/{joining_code}/answered'
+
+
+def _channel(joining_code: str) -> str:
+    return f'engine-events/{joining_code}'
+
+
+# Scores one answer per player per round against the current question,
+# all in one atomic step. The time left comes from Redis' own clock, so
+# neither the client nor a late message can inflate it, and an answer
+# meant for an earlier round is never scored against the current one
+SCORE_ANSWER_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'state', 'round')
+if state[1] ~= 'question' or state[2] ~= ARGV[3] then
+    return false
+end
+local now = redis.call('TIME')
+local time_left = tonumber(redis.call('HGET', KEYS[1], 'deadline')) - (now[1] + now[2] / 1000000)
+if time_left < 0 then
+    return false
+end
+if redis.call('SADD', KEYS[3], ARGV[1] .. '/' .. ARGV[3]) == 0 then
+    return false
+end
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+local question = cjson.decode(redis.call('HGET', KEYS[1], 'question'))
+if question['answers'][question['correct_answer'] + 1] ~= ARGV[2] then
+    return false
+end
+local score = redis.call('ZINCRBY', KEYS[2], math.min(10, math.floor(time_left)), ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return score
+"""
+score_answer_script = redis.register_script(SCORE_ANSWER_SCRIPT)
+
+
+async def create(
+    joining_code: str,
+    players: list,
+    total_questions: int,
+    token: str | None = None,
+    category: str | None = None,
+    difficulty: str | None = None
+):
+    state_key = _state_key(joining_code)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.delete(state_key, _scores_key(joining_code), _names_key(joining_code), _answered_key(joining_code))
+        pipe.hset(state_key, mapping={
+            'state': 'lobby',
+            'round': 0,
+            'total_questions': total_questions,
+            'question': 'null',
+            'deadline': 0,
+            'token': token or '',
+            'category': category or '',
+            'difficulty': difficulty or ''
+        })
+        pipe.hset(_names_key(joining_code), mapping={player.id: player.user_name for player in players})
+        pipe.zadd(_scores_key(joining_code), {player.id: 0 for player in players})
+        for key in (state_key, _names_key(joining_code), _scores_key(joining_code)):
+            pipe.expire(key, ENGINE_TTL)
+        await pipe.execute()
+
+
+async def publish(joining_code: str, message: dict):
+    await redis.publish(_channel(joining_code), json.dumps(message))
+
+
+async def next_question(joining_code: str, expected_round: int):
+    # Only advances from the round the host last saw, so a repeated or
+    # delayed next-question cannot skip a round
+    state_key = _state_key(joining_code)
+    async with redis.lock(f'locks/{state_key}', timeout=LOCK_SECONDS, blocking_timeout=LOCK_SECONDS):
+        state = await redis.hgetall(state_key)
+        state = {field.decode(): value.decode() for field, value in state.items()}
+        if not state or state['state'] == 'finished' or int(state['round']) != expected_round:
+            return
+        if int(state['round']) >= int(state['total_questions']):
+            await redis.hset(state_key, 'state', 'finished')
+            await publish(joining_code, {'type': 'end'})
+            return
+
+        question, _ = await buffer.pop(joining_code)
+        if question is None:
+            try:
+                results = await asyncio.wait_for(
+                    open_trivia.get_questions(
+                        1,
+                        token=state['token'] or None,
+                        category=state['category'] or None,
+                        difficulty=state['difficulty'] or None
+                    ),
+                    FETCH_SECONDS
+                )
+                question = buffer.to_question(results[0])
+            except (asyncio.TimeoutError, OpenTriviaUnavailable, IndexError):
+                # The round stays where it is, so the host can ask again
+                logger.exception('Fetching a question for game %s failed', joining_code)
+                return
+        seconds, microseconds = await redis.time()
+        round_number = int(state['round']) + 1
+        await redis.hset(state_key, mapping={
+            'state': 'question',
+            'round': round_number,
+            'question': question.json(),
+            'deadline': seconds + microseconds / 1000000 + ROUND_SECONDS
+        })
+    await publish(joining_code, {
+        'type': 'question',
+        'round': round_number,
+        'seconds': ROUND_SECONDS,
+        'question': question.question,
+        'answers': question.answers
+    })
+
+
+async def answer(joining_code: str, user_id: int, answer: str, round_number: int):
+    return await score_answer_script(
+        keys=[_state_key(joining_code), _scores_key(joining_code), _answered_key(joining_code)],
+        args=[user_id, answer, round_number, ENGINE_TTL]
+    )
+
+
+async def scores(joining_code: str) -> list[dict]:
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(_scores_key(joining_code), 0, -1, withscores=True)
+        pipe.hgetall(_names_key(joining_code))
+        rankings, names = await pipe.execute()
+    return [
+        {'name': names[user_id].decode(), 'score': int(score)} for user_id, score in rankings
+    ]
+
+
+async def end_round(joining_code: str):
+    # Moving to reveal closes the round, answers arriving after this are not scored
+    state_key = _state_key(joining_code)
+    async with redis.lock(f'locks/{state_key}', timeout=LOCK_SECONDS, blocking_timeout=LOCK_SECONDS):
+        state, question = await redis.hmget(state_key, 'state', 'question')
+        if state != b'question':
+            return
+        await redis.hset(state_key, 'state', 'reveal')
+    question = json.loads(question)
+    await publish(joining_code, {
+        'type': 'round-end',
+        'correct_answer': question['answers'][question['correct_answer']],
+        'scores': await scores(joining_code)
+    })
+
+
+class Room:
+    def __init__(self, joining_code: str):
+        self.joining_code = joining_code
+        self.sockets = set()
+        self.pubsub = redis.pubsub()
+        self.subscribed = asyncio.create_task(self.pubsub.subscribe(_channel(joining_code)))
+        self.listener = asyncio.create_task(self.listen())
+
+    async def listen(self):
+        # One subscription per room per process, fanned out to the local sockets
+        try:
+            await self.subscribed
+            async for message in self.pubsub.listen():
+                if message['type'] != 'message':
+                    continue
+                data = message['data'].decode()
+                await asyncio.gather(
+                    *(websocket.send_text(data) for websocket in list(self.sockets)),
+                    return_exceptions=True
+                )
+        finally:
+            await self.pubsub.unsubscribe(_channel(self.joining_code))
+            await self.pubsub.close()
+
+
+rooms = {}
+
+
+async def join_room(joining_code: str, websocket: WebSocket):
+    room = rooms.get(joining_code)
+    if room is None:
+        room = rooms[joining_code] = Room(joining_code)
+    room.sockets.add(websocket)
+    # Only returns once the room is subscribed, so no event the player's own
+    # messages cause can be published before anyone here is listening
+    await asyncio.shield(room.subscribed)
+
+
+def leave_room(joining_code: str, websocket: WebSocket):
+    room = rooms.get(joining_code)
+    if room is None:
+        return
+    room.sockets.discard(websocket)
+    if not room.sockets:
+        room.subscribed.cancel()
+        room.listener.cancel()
+        del rooms[joining_code]
+
+
+def parse_message(text: str | None) -> dict | None:
+    # Anything that is not a well formed client message is None, and ignored
+    try:
+        message = json.loads(text)
+        if message['type'] in ('answer', 'next-question'):
+            message['round'] = int(message['round'])
+        if message['type'] == 'answer' and not isinstance(message['answer'], str):
+            return None
+    except (KeyError, TypeError, ValueError):
+        return None
+    return message
@@ -49,3 +49,8 @@ class GameAlreadyFull(HTTPException):
 class NotEnoughPlayers(HTTPException):
     def __init__(self):
         super().__init__(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough players")
+
+
+class NoJoiningCodeAvailable(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="No joining code available")
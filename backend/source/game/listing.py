@@ -0,0 +1,29 @@
+from game import schemas
+from users.session import redis
+from settings import get_settings
+
+
+settings = get_settings()
+LISTING_CACHE_TTL = int(settings.GAMES_LISTING_CACHE_TTL)
+
+# Every mutation bumps the version, so stale pages are simply never read again
+# and age out on their own
+VERSION_KEY = 'games-listing/version'
+
+
+async def get_cached_page(after: int | None, limit: int, joinable: bool) -> tuple[str, schemas.GamePage | None]:
+    version = await redis.get(VERSION_KEY)
+    version = version.decode() if version else '0'
+    key = f'games-listing/{version}/{after or 0}/{limit}/{int(joinable)}'
+    page = await redis.get(key)
+    if page is None:
+        return key, None
+    return key, schemas.GamePage.parse_raw(page)
+
+
+async def store_page(key: str, page: schemas.GamePage):
+    await redis.set(key, page.json(), ex=LISTING_CACHE_TTL)
+
+
+async def invalidate():
+    await redis.incr(VERSION_KEY)
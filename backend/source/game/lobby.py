@@ -0,0 +1,28 @@
+import json
+from users.session import redis
+
+
+# Lobby membership changes are pushed to subscribers as they happen, so
+# lobby pages never need to poll the game for its player list
+def channel(joining_code: str) -> str:
+    return f'lobby-events/{joining_code}'
+
+
+async def publish(joining_code: str, event: str, **data):
+    await redis.publish(channel(joining_code), json.dumps({'type': event, **data}))
+
+
+async def joined(joining_code: str, user_id: int, user_name: str):
+    await publish(joining_code, 'joined', user_id=user_id, user_name=user_name)
+
+
+async def left(joining_code: str, user_id: int, user_name: str):
+    await publish(joining_code, 'left', user_id=user_id, user_name=user_name)
+
+
+async def started(joining_code: str):
+    await publish(joining_code, 'started')
+
+
+async def cancelled(joining_code: str):
+    await publish(joining_code, 'cancelled')
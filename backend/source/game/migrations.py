@@ -0,0 +1,59 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+# create_all only creates missing tables, these steps bring tables created
+# by earlier versions up to date. Each one is safe to run on every startup
+async def upgrade(conn: AsyncConnection):
+    # Joining codes used to be unique across all games, now they are reused
+    # and only need to be unique among active ones
+    old_index = await conn.execute(text(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+        "WHERE pg_class.relname = 'ix_games_joining_code' AND pg_index.indisunique"
+    ))
+    if old_index.first():
+        await conn.execute(text("DROP INDEX ix_games_joining_code"))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_games_joining_code ON games (joining_code)"
+    ))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_games_active_joining_code "
+        "ON games (joining_code) WHERE is_active"
+    ))
+
+    await conn.execute(text(
+        "ALTER TABLE games ADD COLUMN IF NOT EXISTS player_count INTEGER DEFAULT 0"
+    ))
+    # Membership used to be an array on the game. It is copied over once and
+    # the array dropped, so players who left since are never copied back
+    legacy_players = await conn.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'games' AND column_name = 'players'"
+    ))
+    if legacy_players.first():
+        await conn.execute(text(
+            "INSERT INTO game_players (game_id, user_id, joined_at) "
+            "SELECT games.id, players.user_id, now() + players.position * interval '1 microsecond' "
+            "FROM games, unnest(games.players) WITH ORDINALITY AS players (user_id, position) "
+            "ON CONFLICT DO NOTHING"
+        ))
+        await conn.execute(text(
+            "UPDATE games SET player_count = "
+            "(SELECT count(*) FROM game_players WHERE game_players.game_id = games.id)"
+        ))
+        await conn.execute(text("ALTER TABLE games DROP COLUMN players"))
+
+    # Results recorded by end_game used to be stored with aggregated NULL,
+    # which neither aggregate() nor the pending index ever picked up
+    nullable_aggregated = await conn.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'game_results' "
+        "AND column_name = 'aggregated' AND is_nullable = 'YES'"
+    ))
+    if nullable_aggregated.first():
+        await conn.execute(text(
+            "UPDATE game_results SET aggregated = false WHERE aggregated IS NULL"
+        ))
+        await conn.execute(text(
+            "ALTER TABLE game_results ALTER COLUMN aggregated SET NOT NULL"
+        ))
@@ -1,15 +1,53 @@
-from sqlalchemy import Column, Integer, String, ARRAY, Boolean
+from sqlalchemy import Column, Integer, String, Boolean, Index, ForeignKey, DateTime
+from sqlalchemy.sql.expression import func
 from db import Base
 
 
 class Game(Base):
     __tablename__ = "games"
     id = Column(Integer, primary_key=True, index=True)
-    joining_code = Column(String, unique=True, index=True)
+    joining_code = Column(String, index=True)
     host_id = Column(Integer)
-    players = Column(ARRAY(Integer))
     max_players = Column(Integer)
+    player_count = Column(Integer, default=0, server_default="0")
     is_started = Column(Boolean)
     is_active = Column(Boolean)
     winner = Column(Integer)
-    open_trivia_token = Column(String)
\ No newline at end of file
+    open_trivia_token = Column(String)
+
+    __table_args__ = (
+        # Codes are reused after a game ends, so they only need to be unique among active games
+        Index(
+            "ix_games_active_joining_code",
+            "joining_code",
+            unique=True,
+            postgresql_where=is_active
+        ),
+    )
+
+
+class GamePlayer(Base):
+    __tablename__ = "game_players"
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    user_id = Column(Integer, primary_key=True, index=True)
+    joined_at = Column(DateTime, server_default=func.now())
+
+
+class GameResult(Base):
+    # One row per player per finished game, only ever appended to. The
+    # aggregated flag marks rows already folded into the users' counters
+    __tablename__ = "game_results"
+    id = Column(Integer, primary_key=True)
+    game_id = Column(Integer, ForeignKey("games.id"), index=True)
+    user_id = Column(Integer, index=True)
+    is_winner = Column(Boolean)
+    aggregated = Column(Boolean, default=False, server_default="false", nullable=False)
+    finished_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index(
+            "ix_game_results_pending",
+            "id",
+            postgresql_where=~aggregated
+        ),
+    )
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from sqlalchemy import func, literal, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import SessionLocal
+from game import models
+from users import cache, models as user_models
+from settings import get_settings
+
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+AGGREGATE_INTERVAL = float(settings.GAME_RESULTS_AGGREGATE_INTERVAL)
+AGGREGATE_BATCH_SIZE = int(settings.GAME_RESULTS_BATCH_SIZE)
+
+
+async def aggregate(db: AsyncSession, batch_size: int = AGGREGATE_BATCH_SIZE) -> int:
+    # Claims a batch of pending results and folds them into the users'
+    # counters in one statement. SKIP LOCKED lets every worker run this
+    # without two of them ever counting the same result
+    pending = (
+        select(models.GameResult.id)
+        .where(models.GameResult.aggregated == False)
+        .order_by(models.GameResult.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = (
+        models.GameResult.__table__.update()
+        .where(models.GameResult.id.in_(pending.scalar_subquery()))
+        .values(aggregated=True)
+        .returning(models.GameResult.user_id, models.GameResult.is_winner)
+        .cte('claimed')
+    )
+    totals = (
+        select(
+            claimed.c.user_id,
+            func.count().label('played'),
+            func.count().filter(claimed.c.is_winner).label('won')
+        )
+        .group_by(claimed.c.user_id)
+        .subquery('totals')
+    )
+    User = user_models.User
+    updated = await db.execute(
+        User.__table__.update()
+        .where(User.id == totals.c.user_id)
+        .values(
+            games_played=func.coalesce(User.games_played, 0) + totals.c.played,
+            games_won=func.coalesce(User.games_won, 0) + totals.c.won
+        )
+        .add_cte(claimed)
+        .returning(User.id, User.user_name, totals.c.played)
+    )
+    updated = updated.all()
+    await db.commit()
+    await cache.invalidate(*((user.id, user.user_name) for user in updated))
+    return sum(user.played for user in updated)
+
+
+async def aggregate_forever():
+    while True:
+        try:
+            async with SessionLocal() as db:
+                while await aggregate(db) >= AGGREGATE_BATCH_SIZE:
+                    pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Aggregating game results failed')
+        await asyncio.sleep(AGGREGATE_INTERVAL)
+
+
+async def rebuild(db: AsyncSession) -> int:
+    # Records results for finished games that predate game_results, then
+    # recomputes every user's counters from the full history
+    await db.execute(text('LOCK TABLE game_results IN EXCLUSIVE MODE'))
+    recorded = await db.execute(
+        models.GameResult.__table__.insert()
+        .from_select(
+            ['game_id', 'user_id', 'is_winner', 'aggregated'],
+            select(
+                models.GamePlayer.game_id,
+                models.GamePlayer.user_id,
+                models.GamePlayer.user_id == models.Game.winner,
+                literal(False)
+            )
+            .join(models.Game, models.Game.id == models.GamePlayer.game_id)
+            .where(models.Game.is_active == False)
+            .where(models.Game.winner != None)
+            .where(~select(models.GameResult.id).where(models.GameResult.game_id == models.Game.id).exists())
+        )
+        .returning(models.GameResult.id)
+    )
+    recorded = len(recorded.all())
+
+    totals = (
+        select(
+            models.GameResult.user_id,
+            func.count().label('played'),
+            func.count().filter(models.GameResult.is_winner).label('won')
+        )
+        .group_by(models.GameResult.user_id)
+        .subquery('totals')
+    )
+    User = user_models.User
+    await db.execute(User.__table__.update().values(games_played=0, games_won=0))
+    await db.execute(
+        User.__table__.update()
+        .where(User.id == totals.c.user_id)
+        .values(games_played=totals.c.played, games_won=totals.c.won)
+    )
+    await db.execute(
+        models.GameResult.__table__.update()
+        .where(models.GameResult.aggregated == False)
+        .values(aggregated=True)
+    )
+    await db.commit()
+    await cache.clear()
+    return recorded
+
+
+async def main():
+    async with SessionLocal() as db:
+        recorded = await rebuild(db)
+    print(f'Recorded results for {recorded} past players, user counters rebuilt')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -19,9 +19,21 @@ class JoinedGame(BaseGame):
 
 
 class Game(BaseGame):
+    joining_code: str
     player_count: int
     host_player_object: User
 
 
+class GamePage(BaseModel):
+    games: List[Game]
+    next_after: int | None
+
+
+class GameStart(BaseModel):
+    total_questions: int = 0
+    category: str | None = None
+    difficulty: str | None = None
+
+
 class GameEnd(BaseModel):
     winner: int
\ No newline at end of file
@@ -0,0 +1,172 @@
+import os
+import time
+from contextvars import ContextVar
+from fastapi import Request, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.routing import Match
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling a request',
+    ['method', 'route']
+)
+REQUESTS = Counter(
+    'http_requests_total',
+    'Requests handled, by response status',
+    ['method', 'route', 'status']
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress',
+    'Requests currently being handled',
+    multiprocess_mode='livesum'
+)
+QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request',
+    'Postgres statements executed while handling a request',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+)
+REDIS_COMMANDS_PER_REQUEST = Histogram(
+    'redis_commands_per_request',
+    'Redis commands sent while handling a request',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+)
+POOL_CHECKOUT = Histogram(
+    'db_pool_checkout_seconds',
+    'Time spent waiting for a Postgres connection from the pool'
+)
+POOL_CONNECTIONS = Gauge(
+    'db_pool_connections',
+    'Postgres connections held by the pool, by state',
+    ['state'],
+    multiprocess_mode='livesum'
+)
+OPEN_TRIVIA_LATENCY = Histogram(
+    'open_trivia_request_duration_seconds',
+    'Latency of Open Trivia DB calls, per attempt',
+    ['path']
+)
+OPEN_TRIVIA_ERRORS = Counter(
+    'open_trivia_errors_total',
+    'Failed Open Trivia DB attempts',
+    ['path', 'reason']
+)
+USER_CACHE_LOOKUPS = Counter(
+    'user_cache_lookups_total',
+    'User profile cache lookups, by cache tier and result',
+    ['tier', 'result']
+)
+
+# Statement and command counts for the request being handled
+_request_counts = ContextVar('request_counts', default=None)
+
+
+def _count(kind: str, amount: int = 1):
+    counts = _request_counts.get()
+    if counts is not None:
+        counts[kind] += amount
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT.observe(time.perf_counter() - start)
+            self._update_gauges()
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        # Summed over the workers, checked_out + idle is what the deployment
+        # holds against Postgres' max_connections
+        POOL_CONNECTIONS.labels('checked_out').set(self.checkedout())
+        POOL_CONNECTIONS.labels('idle').set(self.checkedin())
+        POOL_CONNECTIONS.labels('overflow').set(max(0, self.overflow()))
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        _count('db')
+
+
+def instrument_redis(client):
+    # Plain commands, scripts and locks all go through execute_command,
+    # pipelines are counted by the commands they send in one go
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def counted_execute_command(*args, **options):
+        _count('redis')
+        return await execute_command(*args, **options)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted_execute(*execute_args, **execute_kwargs):
+            _count('redis', len(pipe.command_stack))
+            return await execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    client.execute_command = counted_execute_command
+    client.pipeline = counted_pipeline
+
+
+def _route_name(request: Request) -> str:
+    # Label by route template rather than path, so joining codes and user
+    # names do not each get their own series
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+
+async def record_request(request: Request, call_next):
+    route = _route_name(request)
+    counts = {'db': 0, 'redis': 0}
+    _request_counts.set(counts)
+    REQUESTS_IN_PROGRESS.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUESTS_IN_PROGRESS.dec()
+        REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - start)
+        REQUESTS.labels(request.method, route, status).inc()
+        QUERIES_PER_REQUEST.labels(route).observe(counts['db'])
+        REDIS_COMMANDS_PER_REQUEST.labels(route).observe(counts['redis'])
+
+
+def metrics_response() -> Response:
+    # Under gunicorn every worker writes its samples to
+    # PROMETHEUS_MULTIPROC_DIR, and any one of them can serve the total
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
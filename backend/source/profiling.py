@@ -0,0 +1,171 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from fastapi import Request
+from sqlalchemy import event
+from settings import get_settings
+
+
+settings = get_settings()
+# off: never trace, header: only requests sending X-Profile, all: every request
+PROFILING_MODE = settings.PROFILING_MODE
+PROFILING_DIR = settings.PROFILING_DIR
+PROFILING_SAMPLE = settings.PROFILING_SAMPLE == "1"
+PROFILING_SAMPLE_INTERVAL = float(settings.PROFILING_SAMPLE_INTERVAL)
+
+_trace = ContextVar('trace', default=None)
+
+
+class Sampler(threading.Thread):
+    # Periodically records the event loop thread's stack, cheap enough to
+    # leave running for a whole request unlike a deterministic profiler
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Trace:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.statements = []
+        self.sampler = None
+
+    def record(self, kind: str, statement: str, seconds: float):
+        self.statements.append({'kind': kind, 'statement': statement, 'ms': round(seconds * 1000, 3)})
+
+    def repeated(self) -> list[dict]:
+        # The same statement run again and again within one request is
+        # usually a query in a loop that could have been a single query
+        groups = defaultdict(list)
+        for entry in self.statements:
+            groups[(entry['kind'], entry['statement'])].append(entry['ms'])
+        return [
+            {'kind': kind, 'statement': statement, 'count': len(times), 'ms': round(sum(times), 3)}
+            for (kind, statement), times in groups.items() if len(times) > 1
+        ]
+
+    def totals(self, kind: str) -> tuple[int, float]:
+        times = [entry['ms'] for entry in self.statements if entry['kind'] == kind]
+        return len(times), round(sum(times), 3)
+
+
+def _record(kind: str, statement: str, seconds: float):
+    trace = _trace.get()
+    if trace is not None:
+        trace.record(kind, statement, seconds)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        if _trace.get() is not None:
+            conn.info.setdefault('profiling_started_at', []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        started_at = conn.info.get('profiling_started_at')
+        if started_at:
+            _record('db', statement, time.perf_counter() - started_at.pop())
+
+
+def instrument_redis(client):
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def traced_execute_command(*args, **options):
+        if _trace.get() is None:
+            return await execute_command(*args, **options)
+        start = time.perf_counter()
+        try:
+            return await execute_command(*args, **options)
+        finally:
+            _record('redis', str(args[0]), time.perf_counter() - start)
+
+    def traced_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def traced_execute(*execute_args, **execute_kwargs):
+            if _trace.get() is None:
+                return await execute(*execute_args, **execute_kwargs)
+            commands = ' '.join(str(command[0][0]) for command in pipe.command_stack)
+            start = time.perf_counter()
+            try:
+                return await execute(*execute_args, **execute_kwargs)
+            finally:
+                _record('redis', f'PIPELINE {commands}', time.perf_counter() - start)
+
+        pipe.execute = traced_execute
+        return pipe
+
+    client.execute_command = traced_execute_command
+    client.pipeline = traced_pipeline
+
+
+def _write_trace(trace: Trace, status: int, seconds: float) -> str:
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(trace.started_at))}-{os.urandom(4).hex()}.json"
+    path = os.path.join(PROFILING_DIR, name)
+    with open(path, 'w') as file:
+        json.dump({
+            'method': trace.method,
+            'path': trace.path,
+            'status': status,
+            'ms': round(seconds * 1000, 3),
+            'statements': trace.statements,
+            'repeated': trace.repeated(),
+            # Collapsed stacks, the input format of most flame graph tools
+            'samples': dict(trace.sampler.stacks) if trace.sampler else None
+        }, file, indent=2)
+    return name
+
+
+async def profile_request(request: Request, call_next):
+    requested = request.headers.get('x-profile')
+    if PROFILING_MODE == 'off' or (PROFILING_MODE == 'header' and not requested):
+        return await call_next(request)
+
+    trace = Trace(request.method, request.url.path)
+    _trace.set(trace)
+    if PROFILING_SAMPLE or requested == 'sample':
+        trace.sampler = Sampler(threading.get_ident(), PROFILING_SAMPLE_INTERVAL)
+        trace.sampler.start()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        if trace.sampler:
+            trace.sampler.stop()
+    seconds = time.perf_counter() - start
+
+    db_count, db_ms = trace.totals('db')
+    redis_count, redis_ms = trace.totals('redis')
+    response.headers['X-Profile-Summary'] = (
+        f'total_ms={seconds * 1000:.3f}; db={db_count}; db_ms={db_ms}; '
+        f'redis={redis_count}; redis_ms={redis_ms}; repeated={len(trace.repeated())}; '
+        f'trace={_write_trace(trace, response.status_code, seconds)}'
+    )
+    return response
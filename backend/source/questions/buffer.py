@@ -0,0 +1,113 @@
+import asyncio
+import random
+from users.session import redis
+from questions import schemas
+from questions.opentdb import client as open_trivia
+from settings import get_settings
+
+
+settings = get_settings()
+
+# Open Trivia DB will not return more than this many questions per call
+MAX_BATCH_SIZE = 50
+
+_top_up_tasks = set()
+
+
+def _buffer_key(joining_code: str) -> str:
+    return f'questions/{joining_code}'
+
+
+def _wanted_key(joining_code: str) -> str:
+    return f'questions/{joining_code}/wanted'
+
+
+def to_question(db_question: dict) -> schemas.Question:
+    answers = db_question['incorrect_answers'] + [db_question['correct_answer']]
+    random.shuffle(answers)
+    return schemas.Question(
+        question=db_question['question'],
+        answers=answers,
+        correct_answer=answers.index(db_question['correct_answer']),
+        category_name=db_question['category']
+    )
+
+
+async def fill(
+    joining_code: str,
+    amount: int,
+    token: str | None = None,
+    category: str | None = None,
+    difficulty: str | None = None
+) -> int:
+    questions = []
+    while amount > 0:
+        results = await open_trivia.get_questions(
+            min(amount, MAX_BATCH_SIZE),
+            token=token,
+            category=category,
+            difficulty=difficulty
+        )
+        if not results:
+            break
+        questions.extend(to_question(result).json() for result in results)
+        amount -= len(results)
+
+    if questions:
+        key = _buffer_key(joining_code)
+        async with redis.pipeline(transaction=False) as pipe:
+            await pipe.rpush(key, *questions).expire(key, 3600).execute()
+    return len(questions)
+
+
+async def start(
+    joining_code: str,
+    total_questions: int,
+    token: str | None = None,
+    category: str | None = None,
+    difficulty: str | None = None
+) -> int:
+    await redis.set(_wanted_key(joining_code), total_questions, ex=3600)
+    return await fill(joining_code, total_questions, token, category, difficulty)
+
+
+async def pop(joining_code: str) -> tuple[schemas.Question | None, int]:
+    # The shortfall is how many questions the game still needs beyond what is buffered
+    key = _buffer_key(joining_code)
+    wanted_key = _wanted_key(joining_code)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.lpop(key).llen(key).decr(wanted_key).expire(wanted_key, 3600)
+        question, remaining, wanted, _ = await pipe.execute()
+    shortfall = wanted - remaining
+    if question is None:
+        return None, shortfall
+    return schemas.Question.parse_raw(question), shortfall
+
+
+async def _top_up(joining_code: str, amount: int, token: str | None, category: str | None, difficulty: str | None):
+    lock_key = f'{_buffer_key(joining_code)}/top-up'
+    if not await redis.set(lock_key, 1, nx=True, ex=30):
+        return
+    try:
+        await fill(joining_code, amount, token, category, difficulty)
+    finally:
+        await redis.delete(lock_key)
+
+
+def top_up_in_background(
+    joining_code: str,
+    shortfall: int,
+    token: str | None = None,
+    category: str | None = None,
+    difficulty: str | None = None
+):
+    amount = min(shortfall, int(settings.QUESTION_BUFFER_TOP_UP))
+    if amount <= 0:
+        return
+    task = asyncio.create_task(_top_up(joining_code, amount, token, category, difficulty))
+    _top_up_tasks.add(task)
+    task.add_done_callback(_top_up_tasks.discard)
+
+
+async def clear(joining_code: str):
+    await redis.delete(_buffer_key(joining_code), _wanted_key(joining_code))
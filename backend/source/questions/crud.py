@@ -1,5 +1,6 @@
+import random
+from sqlalchemy import select, true, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
-from  sqlalchemy.sql.expression import func
 from questions import models, schemas, errors
 
 
@@ -125,22 +126,81 @@ async def delete_question(db: AsyncSession, question_id: int):
     await db.commit()
 
 
+def _walk_from_pivot(amount: int, conditions: list, correlate=None):
+    # Reads up to `amount` questions in random_key order starting at a random
+    # pivot, wrapping around to the start of the index if it runs out
+    pivot = random.random()
+
+    def window(bound):
+        query = (
+            select(models.Question.__table__)
+            .where(*conditions, bound)
+            .order_by(models.Question.random_key)
+            .limit(amount)
+        )
+        if correlate is not None:
+            query = query.correlate(correlate)
+        return query
+
+    wrapped = union_all(
+        window(models.Question.random_key >= pivot),
+        window(models.Question.random_key < pivot)
+    ).subquery()
+    return select(wrapped).limit(amount)
+
+
+async def sample_questions(
+    db: AsyncSession,
+    amount: int,
+    category_ids: list[int] | None = None,
+    exclude_ids: list[int] | None = None,
+    exclude_categories: list[int] | None = None
+):
+    categories = select(models.Category.id, models.Category.name)
+    if category_ids:
+        categories = categories.where(models.Category.id.in_(category_ids))
+    if exclude_categories:
+        categories = categories.where(models.Category.id.notin_(exclude_categories))
+    categories = categories.subquery()
+
+    conditions = [models.Question.category_id == categories.c.id]
+    if exclude_ids:
+        conditions.append(models.Question.id.notin_(exclude_ids))
+    per_category = _walk_from_pivot(amount, conditions, correlate=categories).lateral()
+
+    results = await db.execute(
+        select(per_category, categories.c.name.label('category_name'))
+        .select_from(categories.join(per_category, true()))
+    )
+    return [
+        schemas.QuestionWithId(
+            id=result.id,
+            question=result.question,
+            answers=result.answers,
+            correct_answer=result.correct_answer,
+            category_name=result.category_name
+        ) for result in results.all()
+    ]
+
+
 async def get_random_question(db: AsyncSession, exclude_ids: list[int], exclude_categories: list[int]):
+    conditions = []
+    if exclude_ids:
+        conditions.append(models.Question.id.notin_(exclude_ids))
+    if exclude_categories:
+        conditions.append(models.Question.category_id.notin_(exclude_categories))
+    question = _walk_from_pivot(1, conditions).subquery()
     result = await db.execute(
-        models.Question.__table__.select()
-        .where(models.Question.id.notin_(exclude_ids))
-        .where(models.Question.category_id.notin_(exclude_categories))
-        .order_by(func.random())
-        .limit(1)
+        select(question, models.Category.name.label('category_name'))
+        .join(models.Category, models.Category.id == question.c.category_id)
     )
     result = result.first()
     if result is None:
         raise errors.QuestionNotFound("No more questions found")
-    category = await get_category(db, result.category_id)
     return schemas.QuestionWithId(
         id=result.id,
         question=result.question,
         answers=result.answers,
         correct_answer=result.correct_answer,
-        category_name=category.name
-    )
\ No newline at end of file
+        category_name=result.category_name
+    )
@@ -1,12 +1,16 @@
-import random
 from typing import List
 from fastapi import APIRouter, Depends, Query, Response
-import requests
 from sqlalchemy.ext.asyncio import AsyncSession
 from users.session import validate_session
-from questions import schemas
+from questions import schemas, buffer
+from questions.opentdb import client as open_trivia
 from db import get_db
-from game import models, errors
+from game import errors
+from game.crud import get_game_record
+from settings import get_settings
+
+
+settings = get_settings()
 
 
 questions_router = APIRouter(
@@ -24,8 +28,7 @@ async def get_question(
     difficulty: str or None = Query(default=None),
     db: AsyncSession = Depends(get_db)
 ):
-    game = await db.execute(models.Game.__table__.select().where(models.Game.joining_code == game_code))
-    game = game.first()
+    game = await get_game_record(db, game_code)
     if not game:
         raise errors.GameNotFound(game_code)
     if not game.is_active:
@@ -33,31 +36,20 @@ async def get_question(
     if not game.is_started:
         raise errors.GameNotStarted()
     
-    url = 'https://opentdb.com/api.php'
-    params = {
-        'amount': 1,
-        'type': 'multiple',
-        'token': game.open_trivia_token
-    }
-    if category:
-        params['category'] = category
-    if difficulty:
-        params['difficulty'] = difficulty
-    response = requests.get(url, params=params)
-    db_question = response.json()['results'][0]
-    answers = db_question['incorrect_answers'] + [db_question['correct_answer']]
-    random.shuffle(answers)
-    question = schemas.Question(
-        question=db_question['question'],
-        answers=answers,
-        correct_answer=answers.index(db_question['correct_answer']),
-        category_name=db_question['category']
-    )
+    question, shortfall = await buffer.pop(game_code)
+    if shortfall > 0:
+        buffer.top_up_in_background(game_code, shortfall, game.open_trivia_token, category, difficulty)
+    if question is None:
+        results = await open_trivia.get_questions(
+            1,
+            token=game.open_trivia_token,
+            category=category,
+            difficulty=difficulty
+        )
+        question = buffer.to_question(results[0])
     return question
 
 
 @questions_router.get("/categories", response_model=List[schemas.Category])
-def get_categories():
-    category_url = 'https://opentdb.com/api_category.php'
-    response = requests.get(category_url)
-    return response.json()['trivia_categories']
+async def get_categories():
+    return await open_trivia.get_categories()
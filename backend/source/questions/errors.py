@@ -29,4 +29,12 @@ class NoQuestionsFound(HTTPException):
         super().__init__(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"No questions found"
-        )
\ No newline at end of file
+        )
+
+
+class OpenTriviaUnavailable(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Open Trivia DB is unavailable"
+        )
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, ARRAY, Float, ForeignKey, Index
+from sqlalchemy.sql.expression import func
+from db import Base
+
+
+class Category(Base):
+    __tablename__ = "categories"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+    description = Column(String)
+
+
+class Question(Base):
+    __tablename__ = "questions"
+    id = Column(Integer, primary_key=True, index=True)
+    question = Column(String)
+    category_id = Column(Integer, ForeignKey("categories.id"))
+    answers = Column(ARRAY(String))
+    correct_answer = Column(Integer)
+    # Uniform random sort key, lets sampling walk an index from a random pivot
+    random_key = Column(Float, nullable=False, index=True, default=func.random())
+
+    __table_args__ = (
+        Index("ix_questions_category_id_random_key", "category_id", "random_key"),
+    )
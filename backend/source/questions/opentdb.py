@@ -0,0 +1,92 @@
+import asyncio
+import time
+import httpx
+from metrics import OPEN_TRIVIA_ERRORS, OPEN_TRIVIA_LATENCY
+from questions.errors import OpenTriviaUnavailable
+from settings import get_settings
+
+
+settings = get_settings()
+
+
+class OpenTriviaClient:
+    def __init__(self, base_url: str, timeout: float, retries: int, max_connections: int):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.max_connections = max_connections
+        self._client = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(self, path: str, params: dict | None = None) -> dict:
+        if self._client is None:
+            await self.start()
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                response = await self._client.get(path, params=params)
+                OPEN_TRIVIA_LATENCY.labels(path).observe(time.perf_counter() - start)
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()
+                OPEN_TRIVIA_ERRORS.labels(path, str(response.status_code)).inc()
+            except httpx.TransportError as error:
+                OPEN_TRIVIA_LATENCY.labels(path).observe(time.perf_counter() - start)
+                OPEN_TRIVIA_ERRORS.labels(path, type(error).__name__).inc()
+            except httpx.HTTPStatusError as error:
+                OPEN_TRIVIA_ERRORS.labels(path, str(error.response.status_code)).inc()
+                break
+            if attempt < self.retries:
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        raise OpenTriviaUnavailable()
+
+    async def request_token(self) -> str:
+        response = await self.get('api_token.php', params={'command': 'request'})
+        return response['token']
+
+    async def get_questions(
+        self,
+        amount: int,
+        token: str | None = None,
+        category: str | None = None,
+        difficulty: str | None = None
+    ) -> list[dict]:
+        params = {
+            'amount': amount,
+            'type': 'multiple'
+        }
+        if token:
+            params['token'] = token
+        if category:
+            params['category'] = category
+        if difficulty:
+            params['difficulty'] = difficulty
+        response = await self.get('api.php', params=params)
+        return response['results']
+
+    async def get_categories(self) -> list[dict]:
+        response = await self.get('api_category.php')
+        return response['trivia_categories']
+
+
+client = OpenTriviaClient(
+    base_url=settings.OPEN_TRIVIA_URL,
+    timeout=float(settings.OPEN_TRIVIA_TIMEOUT),
+    retries=int(settings.OPEN_TRIVIA_RETRIES),
+    max_connections=int(settings.OPEN_TRIVIA_MAX_CONNECTIONS)
+)
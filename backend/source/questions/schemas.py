@@ -8,6 +8,10 @@ class Question(BaseModel):
     category_name: str
 
 
+class QuestionWithId(Question):
+    id: int
+
+
 class Category(BaseModel):
     id: int
     name: str
@@ -8,6 +8,14 @@ DB_USER  = os.getenv("DB_USER", "postgres")
 DB_PASSWORD  = os.getenv("DB_PASSWORD")
 
 
+# Postgres pool settings
+DB_POOL_SIZE  = os.getenv("DB_POOL_SIZE", "5")
+DB_MAX_OVERFLOW  = os.getenv("DB_MAX_OVERFLOW", "10")
+DB_POOL_TIMEOUT  = os.getenv("DB_POOL_TIMEOUT", "30")
+DB_POOL_RECYCLE  = os.getenv("DB_POOL_RECYCLE", "1800")
+DB_STATEMENT_CACHE_SIZE  = os.getenv("DB_STATEMENT_CACHE_SIZE", "100")
+
+
 # FastAPI settings
 API_HOST  = "localhost"
 API_PORT  = "8000"
@@ -17,4 +25,59 @@ API_PORT  = "8000"
 REDIS_HOST  = "localhost"
 REDIS_PORT  = "6379"
 REDIS_PASSWORD  = os.getenv("REDIS_PASSWORD", "")
-REDIS_DB  = "0"
\ No newline at end of file
+REDIS_DB  = "0"
+
+# Open Trivia DB settings
+OPEN_TRIVIA_URL  = os.getenv("OPEN_TRIVIA_URL", "https://opentdb.com/")
+OPEN_TRIVIA_TIMEOUT  = os.getenv("OPEN_TRIVIA_TIMEOUT", "5")
+OPEN_TRIVIA_RETRIES  = os.getenv("OPEN_TRIVIA_RETRIES", "2")
+OPEN_TRIVIA_MAX_CONNECTIONS  = os.getenv("OPEN_TRIVIA_MAX_CONNECTIONS", "20")
+
+
+# Question buffer settings
+QUESTION_BUFFER_TOP_UP  = os.getenv("QUESTION_BUFFER_TOP_UP", "10")
+
+
+# Session settings
+SESSION_TTL  = os.getenv("SESSION_TTL", "3600")
+SESSION_REFRESH_INTERVAL  = os.getenv("SESSION_REFRESH_INTERVAL", "300")
+SESSION_CACHE_TTL  = os.getenv("SESSION_CACHE_TTL", "0")
+SESSION_CACHE_SIZE  = os.getenv("SESSION_CACHE_SIZE", "10000")
+
+
+# User cache settings
+USER_CACHE_TTL  = os.getenv("USER_CACHE_TTL", "300")
+USER_CACHE_LOCAL_TTL  = os.getenv("USER_CACHE_LOCAL_TTL", "10")
+USER_CACHE_SIZE  = os.getenv("USER_CACHE_SIZE", "10000")
+
+
+# Password hashing settings
+PASSWORD_HASH_ALGORITHM  = os.getenv("PASSWORD_HASH_ALGORITHM", "sha256")
+PASSWORD_HASH_ITERATIONS  = os.getenv("PASSWORD_HASH_ITERATIONS", "100000")
+PASSWORD_HASH_WORKERS  = os.getenv("PASSWORD_HASH_WORKERS", "4")
+
+
+# Game listing settings
+GAMES_LISTING_CACHE_TTL  = os.getenv("GAMES_LISTING_CACHE_TTL", "30")
+
+
+# Joining code settings
+JOINING_CODE_COOLDOWN  = os.getenv("JOINING_CODE_COOLDOWN", "3600")
+JOINING_CODE_REFILL_INTERVAL  = os.getenv("JOINING_CODE_REFILL_INTERVAL", "60")
+
+
+# Game engine settings
+GAME_ENGINE_ENABLED  = os.getenv("GAME_ENGINE_ENABLED", "0")
+GAME_ENGINE_ROUND_SECONDS  = os.getenv("GAME_ENGINE_ROUND_SECONDS", "15")
+
+
+# Game results settings
+GAME_RESULTS_AGGREGATE_INTERVAL  = os.getenv("GAME_RESULTS_AGGREGATE_INTERVAL", "5")
+GAME_RESULTS_BATCH_SIZE  = os.getenv("GAME_RESULTS_BATCH_SIZE", "1000")
+
+
+# Profiling settings
+PROFILING_MODE  = os.getenv("PROFILING_MODE", "off")
+PROFILING_DIR  = os.getenv("PROFILING_DIR", "/tmp/dtrivia-profiles")
+PROFILING_SAMPLE  = os.getenv("PROFILING_SAMPLE", "0")
+PROFILING_SAMPLE_INTERVAL  = os.getenv("PROFILING_SAMPLE_INTERVAL", "0.005")
@@ -0,0 +1,147 @@
+import json
+import time
+from collections import OrderedDict
+from metrics import USER_CACHE_LOOKUPS
+from users import schemas
+from users.session import redis
+from settings import get_settings
+
+
+settings = get_settings()
+USER_CACHE_TTL = int(settings.USER_CACHE_TTL)
+USER_CACHE_LOCAL_TTL = float(settings.USER_CACHE_LOCAL_TTL)
+USER_CACHE_SIZE = int(settings.USER_CACHE_SIZE)
+INVALIDATIONS_CHANNEL = 'user-cache-invalidations'
+
+# user_id -> (user, cached_at), with user_name -> user_id alongside
+_users = OrderedDict()
+_user_ids = {}
+
+
+def _id_key(user_id: int) -> str:
+    return f'user-cache/{user_id}'
+
+
+def _name_key(user_name: str) -> str:
+    return f'user-cache/by-name/{user_name}'
+
+
+def _get_local(user_id: int) -> schemas.User | None:
+    cached = _users.get(user_id)
+    if cached and time.monotonic() - cached[1] < USER_CACHE_LOCAL_TTL:
+        _users.move_to_end(user_id)
+        USER_CACHE_LOOKUPS.labels('local', 'hit').inc()
+        return cached[0]
+    USER_CACHE_LOOKUPS.labels('local', 'miss').inc()
+    return None
+
+
+def _store_local(user: schemas.User):
+    _users[user.id] = (user, time.monotonic())
+    _users.move_to_end(user.id)
+    _user_ids[user.user_name] = user.id
+    if len(_users) > USER_CACHE_SIZE:
+        _, (evicted, _) = _users.popitem(last=False)
+        _user_ids.pop(evicted.user_name, None)
+
+
+def _evict_local(user_id: int, user_name: str):
+    _users.pop(user_id, None)
+    _user_ids.pop(user_name, None)
+
+
+async def get(user_id: int) -> schemas.User | None:
+    users = await get_many([user_id])
+    return users.get(user_id)
+
+
+async def get_many(user_ids) -> dict[int, schemas.User]:
+    users = {}
+    for user_id in user_ids:
+        user = _get_local(user_id)
+        if user is not None:
+            users[user_id] = user
+
+    missing = [user_id for user_id in user_ids if user_id not in users]
+    if missing:
+        for user_id, cached in zip(missing, await redis.mget([_id_key(user_id) for user_id in missing])):
+            if cached is None:
+                USER_CACHE_LOOKUPS.labels('redis', 'miss').inc()
+                continue
+            USER_CACHE_LOOKUPS.labels('redis', 'hit').inc()
+            users[user_id] = schemas.User.parse_raw(cached)
+            _store_local(users[user_id])
+    return users
+
+
+async def get_by_name(user_name: str) -> schemas.User | None:
+    user = _get_local(_user_ids.get(user_name))
+    if user is not None:
+        return user
+
+    cached = await redis.get(_name_key(user_name))
+    if cached is None:
+        USER_CACHE_LOOKUPS.labels('redis', 'miss').inc()
+        return None
+    USER_CACHE_LOOKUPS.labels('redis', 'hit').inc()
+    user = schemas.User.parse_raw(cached)
+    _store_local(user)
+    return user
+
+
+async def store(*users: schemas.User):
+    if not users:
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        for user in users:
+            _store_local(user)
+            pipe.set(_id_key(user.id), user.json(), ex=USER_CACHE_TTL)
+            pipe.set(_name_key(user.user_name), user.json(), ex=USER_CACHE_TTL)
+        await pipe.execute()
+
+
+async def invalidate(*users: tuple[int, str]):
+    # Takes (user_id, user_name) pairs. Other workers drop their local copy
+    # when they see the invalidation, the local TTL bounds it if they miss one
+    if not users:
+        return
+    for user_id, user_name in users:
+        _evict_local(user_id, user_name)
+    async with redis.pipeline(transaction=False) as pipe:
+        for user_id, user_name in users:
+            pipe.delete(_id_key(user_id), _name_key(user_name))
+        pipe.publish(INVALIDATIONS_CHANNEL, json.dumps(users))
+        await pipe.execute()
+
+
+async def clear():
+    _users.clear()
+    _user_ids.clear()
+    batch = []
+    async for key in redis.scan_iter(match='user-cache/*', count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            await redis.unlink(*batch)
+            batch = []
+    if batch:
+        await redis.unlink(*batch)
+    await redis.publish(INVALIDATIONS_CHANNEL, json.dumps(None))
+
+
+async def listen_for_invalidations():
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(INVALIDATIONS_CHANNEL)
+    try:
+        async for message in pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            users = json.loads(message['data'])
+            if users is None:
+                _users.clear()
+                _user_ids.clear()
+                continue
+            for user_id, user_name in users:
+                _evict_local(user_id, user_name)
+    finally:
+        await pubsub.unsubscribe(INVALIDATIONS_CHANNEL)
+        await pubsub.close()
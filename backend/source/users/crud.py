@@ -1,32 +1,51 @@
-import hashlib
 import os
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from users import models, schemas, errors
+from users import models, schemas, errors, cache
+from users.hashing import HASH_ALGORITHM, HASH_ITERATIONS, hash_password, verify_password, needs_rehash
 from users.session import create_session
 
 
 async def get_user_by_id(db: AsyncSession, user_id: int):
-    result = await db.execute(models.User.__table__.select().where(models.User.id == user_id))
-    result = result.first()
-    if result is None:
-        raise errors.UserDoesNotExist(user_id)
-    return schemas.User(
-        id=result.id,
-        user_name=result.user_name,
-        email=result.email,
-        is_active=result.is_active,
-        games_played=result.games_played,
-        games_won=result.games_won
-    )
+    users = await get_users_by_ids(db, [user_id])
+    return users[user_id]
+
+
+async def get_users_by_ids(db: AsyncSession, user_ids: list[int]):
+    user_ids = {int(user_id) for user_id in user_ids}
+    if not user_ids:
+        return {}
+    users = await cache.get_many(user_ids)
+    missing = user_ids - users.keys()
+    if missing:
+        results = await db.execute(models.User.__table__.select().where(models.User.id.in_(missing)))
+        fetched = [
+            schemas.User(
+                id=result.id,
+                user_name=result.user_name,
+                email=result.email,
+                is_active=result.is_active,
+                games_played=result.games_played,
+                games_won=result.games_won
+            ) for result in results.all()
+        ]
+        await cache.store(*fetched)
+        users.update({user.id: user for user in fetched})
+    missing = user_ids - users.keys()
+    if missing:
+        raise errors.UserDoesNotExist(min(missing))
+    return users
 
 
 async def get_user_by_user_name(db: AsyncSession, user_name: str):
+    user = await cache.get_by_name(user_name)
+    if user is not None:
+        return user
     result = await db.execute(models.User.__table__.select().where(models.User.user_name == user_name))
     result = result.first()
     if result is None:
         raise errors.UserDoesNotExist(user_name)
-    return schemas.User(
+    user = schemas.User(
         id=result.id,
         user_name=result.user_name,
         email=result.email,
@@ -34,21 +53,20 @@ async def get_user_by_user_name(db: AsyncSession, user_name: str):
         games_played=result.games_played,
         games_won=result.games_won
     )
+    await cache.store(user)
+    return user
 
 
 async def create_user(db: AsyncSession, user: schemas.UserCreate):
     salt = os.urandom(32)
-    hashed_password = hashlib.pbkdf2_hmac(
-        'sha256',
-        user.password.encode('utf-8'),
-        salt,
-        100000
-    )
+    hashed_password = await hash_password(user.password, salt)
     db_user = models.User(
         user_name=user.user_name,
         email=user.email,
         hashed_password=hashed_password,
-        salt=salt
+        salt=salt,
+        hash_algorithm=HASH_ALGORITHM,
+        hash_iterations=HASH_ITERATIONS
     )
 
     try:
@@ -70,31 +88,44 @@ async def create_user(db: AsyncSession, user: schemas.UserCreate):
     )
 
 
+async def _login_user(db: AsyncSession, result, password: str):
+    if not await verify_password(
+        password,
+        result.salt,
+        result.hashed_password,
+        result.hash_algorithm,
+        result.hash_iterations
+    ):
+        raise errors.IncorrectPassword(result.user_name)
+
+    values = {'is_active': True}
+    if needs_rehash(result.hash_algorithm, result.hash_iterations):
+        values['salt'] = os.urandom(32)
+        values['hashed_password'] = await hash_password(password, values['salt'])
+        values['hash_algorithm'] = HASH_ALGORITHM
+        values['hash_iterations'] = HASH_ITERATIONS
+
+    session_id = await create_session(result.id)
+    await db.execute(models.User.__table__.update().where(models.User.id == result.id).values(**values))
+    await db.commit()
+    await cache.invalidate((result.id, result.user_name))
+    return schemas.UserWithSession(
+        id=result.id,
+        user_name=result.user_name,
+        email=result.email,
+        games_played=result.games_played,
+        games_won=result.games_won,
+        is_active=True,
+        session_id=session_id
+    )
+
+
 async def login_user_by_user_name(db: AsyncSession, user_name: str, password: str):
     result = await db.execute(models.User.__table__.select().where(models.User.user_name == user_name))
     result = result.first()
     if not result:
         raise errors.UserDoesNotExist(user_name)
-    hashed_password = hashlib.pbkdf2_hmac(
-        'sha256',
-        password.encode('utf-8'),
-        result.salt,
-        100000
-    )
-    if hashed_password == result.hashed_password:
-        session_id = await create_session(result.id)
-        await db.execute(models.User.__table__.update().where(models.User.id == result.id).values(is_active=True))
-        await db.commit()
-        return schemas.UserWithSession(
-            id=result.id,
-            user_name=result.user_name,
-            email=result.email,
-            games_played=result.games_played,
-            games_won=result.games_won,
-            is_active=True,
-            session_id=session_id
-        )
-    raise errors.IncorrectPassword()
+    return await _login_user(db, result, password)
 
 
 async def login_user_by_email(db: AsyncSession, email: str, password: str):
@@ -102,23 +133,4 @@ async def login_user_by_email(db: AsyncSession, email: str, password: str):
     result = result.first()
     if not result:
         raise errors.UserDoesNotExist(email)
-    hashed_password = hashlib.pbkdf2_hmac(
-        'sha256',
-        password.encode('utf-8'),
-        result.salt,
-        100000
-    )
-    if hashed_password == result.hashed_password:
-        session_id = await create_session(result.id)
-        await db.execute(models.User.__table__.update().where(models.User.id == result.id).values(is_active=True))
-        await db.commit()
-        return schemas.UserWithSession(
-            id=result.id,
-            user_name=result.user_name,
-            email=result.email,
-            games_played=result.games_played,
-            games_won=result.games_won,
-            is_active=True,
-            session_id=session_id
-        )
-    raise errors.IncorrectPassword()
+    return await _login_user(db, result, password)
@@ -1,13 +1,14 @@
-from aioredis import Redis
+import asyncio
 from fastapi import APIRouter, Header, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
-from users import schemas, crud, models
-from users.session import validate_session, delete_session
-from db import engine, get_db
+from users import schemas, crud, models, cache, migrations
+from users.session import SESSION_CACHE_TTL, redis, validate_session, delete_session, listen_for_evictions
+from db import engine, get_db, lock_schema
 from settings import get_settings
 
 
 settings = get_settings()
+listener_tasks = set()
 
 
 router = APIRouter(
@@ -20,22 +21,33 @@ router = APIRouter(
 @router.on_event("startup")
 async def startup():
     async with engine.begin() as conn:
+        await lock_schema(conn)
         await conn.run_sync(models.Base.metadata.create_all)
-    
-    redis = Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        password=settings.REDIS_PASSWORD,
-        db=settings.REDIS_DB
-    )
-    for key in await redis.keys("sessions/*"):
-        await redis.delete(key)
+        await migrations.upgrade(conn)
+
+    batch = []
+    async for key in redis.scan_iter(match='sessions/*', count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            await redis.unlink(*batch)
+            batch = []
+    if batch:
+        await redis.unlink(*batch)
 
     async with engine.begin() as db:
-        active_users = await db.execute(models.User.__table__.select().where(models.User.is_active == True))
-        active_users = active_users.all()
-        for user in active_users:
-            await db.execute(models.User.__table__.update().where(models.User.id == user.id).values(is_active=False))
+        await db.execute(
+            models.User.__table__.update().where(models.User.is_active == True).values(is_active=False)
+        )
+    await cache.clear()
+    listener_tasks.add(asyncio.create_task(cache.listen_for_invalidations()))
+    if SESSION_CACHE_TTL > 0:
+        listener_tasks.add(asyncio.create_task(listen_for_evictions()))
+
+
+@router.on_event("shutdown")
+async def shutdown():
+    for task in listener_tasks:
+        task.cancel()
 
 
 @router.post("/", response_model=schemas.User, status_code=201)
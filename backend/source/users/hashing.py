@@ -0,0 +1,50 @@
+import asyncio
+import hashlib
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from settings import get_settings
+
+
+settings = get_settings()
+HASH_ALGORITHM = settings.PASSWORD_HASH_ALGORITHM
+HASH_ITERATIONS = int(settings.PASSWORD_HASH_ITERATIONS)
+
+# hashlib releases the GIL while hashing, so a thread pool keeps the event loop free
+executor = ThreadPoolExecutor(
+    max_workers=int(settings.PASSWORD_HASH_WORKERS),
+    thread_name_prefix="password-hash"
+)
+
+
+async def hash_password(
+    password: str,
+    salt: bytes,
+    algorithm: str = HASH_ALGORITHM,
+    iterations: int = HASH_ITERATIONS
+) -> bytes:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        hashlib.pbkdf2_hmac,
+        algorithm,
+        password.encode('utf-8'),
+        salt,
+        iterations
+    )
+
+
+async def verify_password(
+    password: str,
+    salt: bytes,
+    hashed_password: bytes,
+    algorithm: str,
+    iterations: int
+) -> bool:
+    return hmac.compare_digest(
+        await hash_password(password, salt, algorithm, iterations),
+        hashed_password
+    )
+
+
+def needs_rehash(algorithm: str, iterations: int) -> bool:
+    return algorithm != HASH_ALGORITHM or iterations < HASH_ITERATIONS
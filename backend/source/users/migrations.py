@@ -0,0 +1,15 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+# create_all only creates missing tables, these steps bring tables created
+# by earlier versions up to date. Each one is safe to run on every startup
+async def upgrade(conn: AsyncConnection):
+    # Users registered before the hashing parameters were recorded were all
+    # hashed with sha256 and 100000 iterations, which the defaults fill in
+    await conn.execute(text(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS hash_algorithm VARCHAR DEFAULT 'sha256'"
+    ))
+    await conn.execute(text(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS hash_iterations INTEGER DEFAULT 100000"
+    ))
@@ -9,6 +9,8 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(LargeBinary)
     salt = Column(LargeBinary)
+    hash_algorithm = Column(String, default="sha256", server_default="sha256")
+    hash_iterations = Column(Integer, default=100000, server_default="100000")
     is_active = Column(Boolean, default=False)
     games_played = Column(Integer, default=0)
     games_won = Column(Integer, default=0)
@@ -1,7 +1,12 @@
+import json
 import os
+import time
+from collections import OrderedDict
 from aioredis import Redis
-from fastapi import Header
+from fastapi import Depends, Header
 from users.errors import UserNotLoggedIn
+import metrics
+import profiling
 from settings import get_settings
 
 
@@ -12,6 +17,16 @@ redis = Redis(
     password=settings.REDIS_PASSWORD,
     db=settings.REDIS_DB
 )
+metrics.instrument_redis(redis)
+profiling.instrument_redis(redis)
+SESSION_TTL = int(settings.SESSION_TTL)
+SESSION_REFRESH_INTERVAL = float(settings.SESSION_REFRESH_INTERVAL)
+SESSION_CACHE_TTL = float(settings.SESSION_CACHE_TTL)
+SESSION_CACHE_SIZE = int(settings.SESSION_CACHE_SIZE)
+EVICTIONS_CHANNEL = 'session-cache-evictions'
+
+# session_id -> (user_id, cached_at, refreshed_at)
+_session_cache = OrderedDict()
 
 
 async def create_session(user_id: str) -> str:
@@ -19,24 +34,67 @@ async def create_session(user_id: str) -> str:
     if session_id:
         return session_id
     session_id = os.urandom(32).hex()
-    await redis.set(f'sessions/{session_id}', user_id)
-    await redis.expire(f'sessions/{session_id}', 3600)
+    await redis.set(f'sessions/{session_id}', user_id, ex=SESSION_TTL)
     return session_id
 
 
-async def get_user_id(session_id: str = Header()) -> str:
-    user_id = await redis.get(f'sessions/{session_id}')
-    if user_id:
-        await redis.expire(f'sessions/{session_id}', 3600)
-        return int(user_id)
-    raise UserNotLoggedIn()
+async def _resolve_session(session_id: str) -> int | None:
+    now = time.monotonic()
+    cached = _session_cache.get(session_id)
+    if cached and now - cached[1] < SESSION_CACHE_TTL:
+        _session_cache.move_to_end(session_id)
+        return cached[0]
 
+    # Only slide the expiry once per refresh interval, a plain GET otherwise
+    refreshed_at = cached[2] if cached else None
+    if refreshed_at is None or now - refreshed_at >= SESSION_REFRESH_INTERVAL:
+        user_id = await redis.execute_command('GETEX', f'sessions/{session_id}', 'EX', SESSION_TTL)
+        refreshed_at = now
+    else:
+        user_id = await redis.get(f'sessions/{session_id}')
 
-async def delete_session(session_id: str) -> None:
-    await redis.delete(f'sessions/{session_id}')
+    if not user_id:
+        _session_cache.pop(session_id, None)
+        return None
+    _session_cache[session_id] = (int(user_id), now, refreshed_at)
+    _session_cache.move_to_end(session_id)
+    if len(_session_cache) > SESSION_CACHE_SIZE:
+        _session_cache.popitem(last=False)
+    return int(user_id)
 
 
-async def validate_session(session_id: str = Header()):
-    if not await redis.exists(f'sessions/{session_id}'):
+async def get_user_id(session_id: str = Header()) -> int:
+    user_id = await _resolve_session(session_id)
+    if user_id is None:
         raise UserNotLoggedIn()
-    await redis.expire(f'sessions/{session_id}', 3600)
+    return user_id
+
+
+async def delete_session(session_id: str) -> None:
+    # Other workers may have the session cached too, they drop it when they
+    # see the eviction so a logged out session stops working everywhere
+    _session_cache.pop(session_id, None)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.delete(f'sessions/{session_id}')
+        if SESSION_CACHE_TTL > 0:
+            pipe.publish(EVICTIONS_CHANNEL, json.dumps(session_id))
+        await pipe.execute()
+
+
+async def listen_for_evictions():
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(EVICTIONS_CHANNEL)
+    try:
+        async for message in pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            _session_cache.pop(json.loads(message['data']), None)
+    finally:
+        await pubsub.unsubscribe(EVICTIONS_CHANNEL)
+        await pubsub.close()
+
+
+async def validate_session(user_id: int = Depends(get_user_id)):
+    # get_user_id is cached per request, so routes that also depend on it
+    # resolve the session only once
+    pass
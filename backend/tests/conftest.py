@@ -0,0 +1,114 @@
+import asyncio
+import os
+import socket
+import sys
+import pytest
+
+
+# The tests run against a real Postgres and Redis on localhost, in a database
+# of their own, e.g. after `docker compose up postgres redis`
+os.environ.setdefault('DB_NAME', 'dtrivia-test')
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'loadtest'))
+# Shared with the benchmarks, it also puts the backend's sources on the path
+from backend_env import create_database, create_tables  # noqa: E402
+
+
+def _reachable(port: int) -> bool:
+    try:
+        socket.create_connection(('localhost', port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+if not (_reachable(5432) and _reachable(6379)):
+    pytest.skip('Postgres and Redis need to be running on localhost', allow_module_level=True)
+
+
+def _run(coroutine):
+    # The engine's pool, the Redis client and the Open Trivia DB client hold
+    # connections bound to the loop that opened them, so every test closes
+    # them before its loop goes away
+    from db import engine
+    from questions.opentdb import client as open_trivia
+    from users.session import redis
+
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await open_trivia.close()
+            await engine.dispose()
+            await redis.connection_pool.disconnect()
+    return asyncio.run(main())
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    asyncio.run(create_database())
+    _run(create_tables())
+
+
+@pytest.fixture
+def run():
+    return _run
+
+
+async def _make_players(count: int) -> list[tuple[int, str]]:
+    # Inserted directly, hashing a password per player would only slow the
+    # tests down. Returns (user_id, session_id) pairs
+    import uuid
+    from db import SessionLocal
+    from users import models
+    from users.session import create_session
+
+    prefix = uuid.uuid4().hex[:8]
+    async with SessionLocal() as db:
+        user_ids = await db.execute(
+            models.User.__table__.insert()
+            .values([
+                {'user_name': f'test-{prefix}-{number}', 'email': f'test-{prefix}-{number}@test.invalid'}
+                for number in range(count)
+            ])
+            .returning(models.User.id)
+        )
+        user_ids = user_ids.scalars().all()
+        await db.commit()
+    return [(user_id, await create_session(user_id)) for user_id in user_ids]
+
+
+@pytest.fixture
+def make_players():
+    return _make_players
+
+
+async def _open_game(host_id: int, max_players: int, player_ids: list[int] = ()) -> tuple[int, str]:
+    # An open game with the host and any other players already in it.
+    # Returns (game_id, joining_code)
+    import uuid
+    from db import SessionLocal
+    from game import models
+
+    joining_code = f'test-{uuid.uuid4().hex[:8]}'
+    async with SessionLocal() as db:
+        game = models.Game(
+            joining_code=joining_code,
+            host_id=host_id,
+            max_players=max_players,
+            player_count=1 + len(player_ids),
+            is_started=False,
+            is_active=True
+        )
+        db.add(game)
+        await db.flush()
+        game_id = game.id
+        for user_id in [host_id, *player_ids]:
+            db.add(models.GamePlayer(game_id=game_id, user_id=user_id))
+        await db.commit()
+    return game_id, joining_code
+
+
+@pytest.fixture
+def open_game():
+    return _open_game
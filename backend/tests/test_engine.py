@@ -0,0 +1,50 @@
+import asyncio
+import json
+import uuid
+from game import engine
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = []
+
+    async def send_text(self, data: str):
+        self.received.append(json.loads(data))
+
+
+async def _publish_right_after_joining():
+    joining_code = f'test-{uuid.uuid4().hex[:8]}'
+    websocket = FakeWebSocket()
+    await engine.join_room(joining_code, websocket)
+    room = engine.rooms[joining_code]
+    # Nothing gives the listener a head start, the event goes out as soon
+    # as joining returns
+    await engine.publish(joining_code, {'type': 'question', 'round': 1})
+    for _ in range(100):
+        if websocket.received:
+            break
+        await asyncio.sleep(0.02)
+    engine.leave_room(joining_code, websocket)
+    await asyncio.gather(room.listener, return_exceptions=True)
+    return websocket.received
+
+
+def test_event_published_right_after_joining_is_delivered(run):
+    assert run(_publish_right_after_joining()) == [{'type': 'question', 'round': 1}]
+
+
+def test_malformed_messages_are_ignored():
+    for text in [
+        None,
+        'not json',
+        '[]',
+        '"answer"',
+        '{}',
+        '{"type": "answer", "answer": "Paris"}',
+        '{"type": "answer", "answer": ["Paris"], "round": 1}',
+        '{"type": "next-question", "round": "first"}'
+    ]:
+        assert engine.parse_message(text) is None
+
+    assert engine.parse_message('{"type": "next-question", "round": "2"}') == {'type': 'next-question', 'round': 2}
+    assert engine.parse_message('{"type": "request-scores"}') == {'type': 'request-scores'}
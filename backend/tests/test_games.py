@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+import uuid
+import httpx
+import pytest
+import fake_opentdb
+from sqlalchemy import func, select
+from app import app
+from db import SessionLocal
+from game import codes, models
+from questions.opentdb import client as open_trivia
+
+
+JOINS = 100
+
+
+async def _join_concurrently(make_players, open_game, max_players: int):
+    # Every join is its own request from its own player, all of them in
+    # flight at once and competing for the same game row
+    players = await make_players(JOINS + 1)
+    game_id, joining_code = await open_game(players[0][0], max_players)
+    async with httpx.AsyncClient(app=app, base_url='http://test', timeout=60) as client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.post(f'/games/{joining_code}/join', headers={'session-id': session_id})
+            for _, session_id in players[1:]
+        ))
+        seconds = time.perf_counter() - started
+
+    async with SessionLocal() as db:
+        player_count = await db.scalar(select(models.Game.player_count).where(models.Game.id == game_id))
+        members = await db.scalar(
+            select(func.count()).select_from(models.GamePlayer).where(models.GamePlayer.game_id == game_id)
+        )
+    return [response.status_code for response in responses], player_count, members, seconds
+
+
+def test_concurrent_joins_are_not_lost(run, make_players, open_game, record_property):
+    statuses, player_count, members, seconds = run(_join_concurrently(make_players, open_game, JOINS + 1))
+
+    assert statuses == [200] * JOINS
+    assert player_count == JOINS + 1
+    assert members == JOINS + 1
+    record_property('joins_per_second', round(JOINS / seconds, 1))
+    print(f'{JOINS} concurrent joins in {seconds:.3f}s, {JOINS / seconds:.1f} joins/s')
+
+
+def test_concurrent_joins_respect_capacity(run, make_players, open_game):
+    statuses, player_count, members, _ = run(_join_concurrently(make_players, open_game, 50))
+
+    assert statuses.count(200) == 49
+    assert statuses.count(403) == JOINS - 49
+    assert player_count == 50
+    assert members == 50
+
+
+@pytest.fixture
+def fake_open_trivia():
+    server = fake_opentdb.serve(0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    open_trivia.base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+async def _create_game(make_players):
+    [(user_id, session_id)] = await make_players(1)
+    async with httpx.AsyncClient(app=app, base_url='http://test', timeout=10) as client:
+        response = await client.post(
+            '/games/',
+            json={'host_player': user_id, 'max_players': 4},
+            headers={'session-id': session_id}
+        )
+    return user_id, response
+
+
+def test_create_game_returns_the_host_as_first_player(run, make_players, fake_open_trivia):
+    user_id, response = run(_create_game(make_players))
+
+    assert response.status_code == 201
+    assert [player['id'] for player in response.json()['players']] == [user_id]
+
+
+def test_create_game_draws_again_when_a_code_is_in_use(run, make_players, open_game, fake_open_trivia, monkeypatch):
+    # As when the pool is empty and a fallback code matches an active game
+    [(host_id, _)] = run(make_players(1))
+    _, code_in_use = run(open_game(host_id, 4))
+    fresh_code = f'test-{uuid.uuid4().hex[:8]}'
+    drawn = iter([code_in_use, fresh_code])
+
+    async def allocate():
+        return next(drawn)
+
+    monkeypatch.setattr(codes, 'allocate', allocate)
+    _, response = run(_create_game(make_players))
+
+    assert response.status_code == 201
+    assert response.json()['joining_code'] == fresh_code
+
+
+async def _start_and_end(make_players, open_game):
+    (host_id, session_id), (player_id, _) = await make_players(2)
+    _, joining_code = await open_game(host_id, 4, [player_id])
+    headers = {'session-id': session_id}
+    async with httpx.AsyncClient(app=app, base_url='http://test', timeout=10) as client:
+        started = await client.post(f'/games/{joining_code}/start', json={}, headers=headers)
+        ended = await client.post(f'/games/{joining_code}/end', json={'winner': host_id}, headers=headers)
+    return started.json(), ended.json()
+
+
+def test_start_and_end_return_the_updated_game(run, make_players, open_game):
+    started, ended = run(_start_and_end(make_players, open_game))
+
+    assert (started['is_started'], started['is_active']) == (True, True)
+    assert (ended['is_started'], ended['is_active']) == (True, False)
+
+
+async def _leave_while_starting(make_players, open_game):
+    players = await make_players(11)
+    (host_id, host_session), others = players[0], players[1:]
+    game_id, joining_code = await open_game(host_id, 20, [user_id for user_id, _ in others])
+    async with httpx.AsyncClient(app=app, base_url='http://test', timeout=30) as client:
+        started, *_ = await asyncio.gather(
+            client.post(f'/games/{joining_code}/start', json={}, headers={'session-id': host_session}),
+            *(
+                client.post(f'/games/{joining_code}/leave', headers={'session-id': session_id})
+                for _, session_id in others[1:]
+            )
+        )
+    async with SessionLocal() as db:
+        player_count = await db.scalar(select(models.Game.player_count).where(models.Game.id == game_id))
+        members = await db.execute(select(models.GamePlayer.user_id).where(models.GamePlayer.game_id == game_id))
+        members = set(members.scalars().all())
+    return started.json(), player_count, members
+
+
+def test_leaves_racing_a_start_leave_the_started_game_alone(run, make_players, open_game):
+    started, player_count, members = run(_leave_while_starting(make_players, open_game))
+
+    # Whoever the game started with stays in it, and the count agrees
+    assert {player['id'] for player in started['players']} == members
+    assert player_count == len(members)
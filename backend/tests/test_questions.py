@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+import uuid
+import httpx
+import fake_opentdb
+from app import app
+from db import SessionLocal
+from game import models
+from questions.opentdb import client as open_trivia
+
+
+OPEN_TRIVIA_LATENCY = 1.0
+
+
+async def _started_game(host_id: int) -> str:
+    # Started without going through start_game, so nothing is buffered and
+    # every question is fetched from Open Trivia DB on demand
+    joining_code = f'test-{uuid.uuid4().hex[:8]}'
+    async with SessionLocal() as db:
+        db.add(models.Game(
+            joining_code=joining_code,
+            host_id=host_id,
+            max_players=2,
+            player_count=1,
+            is_started=True,
+            is_active=True
+        ))
+        await db.commit()
+    return joining_code
+
+
+def test_slow_open_trivia_does_not_block_other_requests(run, make_players):
+    server = fake_opentdb.serve(0, latency=OPEN_TRIVIA_LATENCY)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    open_trivia.base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+
+    async def scenario():
+        [(user_id, session_id)] = await make_players(1)
+        joining_code = await _started_game(user_id)
+        headers = {'session-id': session_id}
+        async with httpx.AsyncClient(app=app, base_url='http://test', timeout=10) as client:
+            started = time.perf_counter()
+            question = asyncio.create_task(
+                client.get('/questions/', params={'game_code': joining_code}, headers=headers)
+            )
+            await asyncio.sleep(0.1)
+
+            stats = await client.get('/db/stats')
+            stats_seconds = time.perf_counter() - started
+            assert stats.status_code == 200
+            assert not question.done()
+
+            question = await question
+            question_seconds = time.perf_counter() - started
+        return question, stats_seconds, question_seconds
+
+    try:
+        question, stats_seconds, question_seconds = run(scenario())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert question.status_code == 200
+    assert question.json()['question']
+    assert question_seconds >= OPEN_TRIVIA_LATENCY
+    assert stats_seconds < OPEN_TRIVIA_LATENCY / 2
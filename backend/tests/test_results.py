@@ -0,0 +1,41 @@
+import httpx
+from sqlalchemy import select
+from app import app
+from db import SessionLocal
+from game import models, results
+from users import models as user_models
+
+
+async def _end_and_aggregate(make_players, open_game):
+    (host_id, session_id), (player_id, _) = await make_players(2)
+    game_id, joining_code = await open_game(host_id, 4, [player_id])
+    async with httpx.AsyncClient(app=app, base_url='http://test', timeout=10) as client:
+        response = await client.post(
+            f'/games/{joining_code}/end',
+            json={'winner': player_id},
+            headers={'session-id': session_id}
+        )
+
+    # Other tests may have left results behind, every pending one is folded in
+    async with SessionLocal() as db:
+        while await results.aggregate(db):
+            pass
+        counters = await db.execute(
+            select(user_models.User.id, user_models.User.games_played, user_models.User.games_won)
+            .where(user_models.User.id.in_([host_id, player_id]))
+        )
+        counters = {user_id: (played, won) for user_id, played, won in counters}
+        aggregated = await db.execute(
+            select(models.GameResult.aggregated).where(models.GameResult.game_id == game_id)
+        )
+        aggregated = aggregated.scalars().all()
+    return response.status_code, counters[host_id], counters[player_id], aggregated
+
+
+def test_ended_game_is_counted_in_player_stats(run, make_players, open_game):
+    status, host, winner, aggregated = run(_end_and_aggregate(make_players, open_game))
+
+    assert status == 200
+    assert aggregated == [True, True]
+    assert host == (1, 0)
+    assert winner == (1, 1)
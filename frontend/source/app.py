@@ -1,4 +1,14 @@
+from settings import get_settings
+
+settings = get_settings()
+if settings.SOCKETIO_ASYNC_MODE == 'gevent':
+    # The Redis message queue client must cooperate with the gevent loop
+    from gevent import monkey
+    monkey.patch_all()
+
+import json
 import re
+import time
 from flask import (
     Flask,
     render_template,
@@ -6,23 +16,38 @@ from flask import (
     redirect,
     url_for,
     flash,
-    session
+    session,
+    g
 )
 from flask_socketio import SocketIO, emit, join_room, leave_room, emit
-from settings import get_settings
 from utils import login_required, make_backend_request
-from threading import Lock
-from game import Game
+from game import Game, get_redis
 
 
 EMAIL_REGEX = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-game_access_lock = Lock()
+ROUND_SECONDS = int(settings.ROUND_SECONDS)
+REVEAL_SECONDS = int(settings.REVEAL_SECONDS)
+ANSWER_GRACE_SECONDS = 0.5
+LOBBY_LISTEN_SECONDS = 5
+LOBBY_POLL_SECONDS = 0.05
+
+# Rooms this process is forwarding lobby events for
+lobby_listeners = set()
 
 
 app = Flask(__name__)
-settings = get_settings()
 app.secret_key = settings.FLASK_SECRET_KEY
-socket_app = SocketIO(app)#, async_mode='gevent')
+socket_app = SocketIO(
+    app,
+    async_mode=settings.SOCKETIO_ASYNC_MODE,
+    message_queue=settings.SOCKETIO_MESSAGE_QUEUE
+)
+
+
+@app.after_request
+def count_backend_calls(response):
+    response.headers['X-Backend-Calls'] = str(g.get('backend_calls', 0))
+    return response
 
 
 @app.route('/')
@@ -106,10 +131,10 @@ def create_game():
             session['user_id'],
             data['number_of_questions'],
             selected_category,
-            difficulty
+            difficulty,
+            session['user_name']
         )
-        with game_access_lock:
-            game.commit_to_redis()
+        game.commit_to_redis()
         return redirect(url_for('game_lobby', joining_code=response.json()['joining_code']))
     flash(f'Failed to create game: {response.json()["detail"]}')
     return redirect(url_for('index'))
@@ -130,10 +155,9 @@ def join_game():
     if response.status_code == 200:
 
         # Update the game object
-        with game_access_lock:
-            game = Game.get_game_from_redis(data['joining_code'])
-            game.add_player(session['user_id'])
-            game.commit_to_redis()
+        game = Game.get_game_from_redis(data['joining_code'])
+        game.add_player(session['user_id'], session['user_name'])
+        game.commit_to_redis()
 
         flash('Game joined successfully')
         return redirect(url_for('game_lobby', joining_code=response.json()['joining_code']))
@@ -148,13 +172,9 @@ def join_game():
 @login_required
 def game_lobby(joining_code):
     try:
-        with game_access_lock:
-            game = Game.get_game_from_redis(joining_code)
-        backend_game = make_backend_request('get', f'games/{joining_code}').json()
-        game_players = [
-            player['user_name'] for player in backend_game['players']
-        ]
-        game_host_id = backend_game['host_player']
+        game = Game.get_game_from_redis(joining_code)
+        game_players = [game.player_names[str(player)] for player in game.players]
+        game_host_id = game.host_player
     except KeyError as e:
         flash('Game not found')
         return redirect(url_for('index'))
@@ -165,8 +185,7 @@ def game_lobby(joining_code):
 @login_required
 def game_room(joining_code):
     try:
-        with game_access_lock:
-            game = Game.get_game_from_redis(joining_code)
+        game = Game.get_game_from_redis(joining_code)
         backend_game = make_backend_request('get', f'games/{joining_code}').json()
         print(backend_game)
         game_players = [
@@ -187,19 +206,14 @@ def game_room(joining_code):
 @login_required
 def game_results(joining_code):
     try:
-        with game_access_lock:
-            game = Game.get_game_from_redis(joining_code)
-        backend_game = make_backend_request('get', f'games/{joining_code}').json()
-        user_id_to_name = {
-            player['id']: player['user_name'] for player in backend_game['players']
-        }
+        game = Game.get_game_from_redis(joining_code)
         if not game.is_finished:
             flash('Game has not finished yet')
             return redirect(url_for('game_lobby', joining_code=joining_code))
         
-        sorted_scores = sorted(game.current_scores.items(), key=lambda x: x[1], reverse=True)
+        sorted_scores = Game.get_rankings(joining_code)
         scores_with_user_names = {
-            user_id_to_name[int(user_id)]: score for user_id, score in sorted_scores
+            game.player_names[user_id]: score for user_id, score in sorted_scores
         }
         make_backend_request('post', f'games/{joining_code}/end', data={'winner': int(sorted_scores[0][0])})
         return render_template('results.html', game=game, scores=scores_with_user_names)
@@ -209,36 +223,79 @@ def game_results(joining_code):
         return redirect(url_for('index'))
 
 
+def forward_lobby_events(joining_code):
+    # One subscription per room per process. Each process only emits to its
+    # own sockets, the backend already published the event to all of them
+    pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(f'lobby-events/{joining_code}')
+    checked_at = time.monotonic()
+    try:
+        while True:
+            # Polled without blocking, a blocking read would hold up every other
+            # greenlet whenever the socket module is not patched
+            message = pubsub.get_message()
+            if message is None:
+                if time.monotonic() - checked_at >= LOBBY_LISTEN_SECONDS:
+                    if not any(socket_app.server.manager.get_participants('/', joining_code)):
+                        return
+                    checked_at = time.monotonic()
+                socket_app.sleep(LOBBY_POLL_SECONDS)
+                continue
+            event = json.loads(message['data'])
+            if event['type'] == 'joined':
+                socket_app.emit('lobby/player-joined', {'player': event['user_name']}, to=joining_code, ignore_queue=True)
+            elif event['type'] == 'left':
+                socket_app.emit('lobby/player-left', {'player': event['user_name']}, to=joining_code, ignore_queue=True)
+            elif event['type'] == 'started':
+                socket_app.emit('lobby/game-started', {}, to=joining_code, ignore_queue=True)
+                return
+            elif event['type'] == 'cancelled':
+                socket_app.emit('lobby/game-cancelled', {}, to=joining_code, ignore_queue=True)
+                return
+    finally:
+        lobby_listeners.discard(joining_code)
+        pubsub.close()
+
+
 @socket_app.on('lobby/join')
 def lobby_on_join(data):
     join_room(data['joining_code'])
-    backend_game = make_backend_request('get', f'games/{data["joining_code"]}').json()
-    game_players = [
-        player['user_name'] for player in backend_game['players']
-    ]
-    emit('lobby/player-joined', {'players': game_players}, to=data['joining_code'])
+    if data['joining_code'] not in lobby_listeners:
+        lobby_listeners.add(data['joining_code'])
+        socket_app.start_background_task(forward_lobby_events, data['joining_code'])
+
+    # Only the new viewer needs the full list, everyone else gets deltas
+    game = Game.get_game_from_redis(data['joining_code'])
+    emit('lobby/players', {'players': [game.player_names[str(player)] for player in game.players]})
 
 
 @socket_app.on('lobby/leave')
 def lobby_on_leave(data):
     leave_room(data['joining_code'])
-    with game_access_lock:
+    response = make_backend_request('post', f'games/{data["joining_code"]}/leave')
+    if response.status_code == 200:
         game = Game.get_game_from_redis(data['joining_code'])
         game.remove_player(session['user_id'])
         game.commit_to_redis()
-    emit('lobby/player-left', {}, to=data['joining_code'])
+    # Acknowledged either way, so the page can move on
+    return response.status_code == 200
 
 
 @socket_app.on('lobby/start-game')
 def lobby_on_start_game(data):
-    response = make_backend_request('post', f'games/{data["joining_code"]}/start')
+    game = Game.get_game_from_redis(data['joining_code'])
+    deck = {
+        'total_questions': int(game.total_questions),
+        'category': game.selected_category,
+        'difficulty': game.difficulty
+    }
+    response = make_backend_request('post', f'games/{data["joining_code"]}/start', deck)
     if response.status_code == 200:
         flash('Game started successfully')
-        with game_access_lock:
-            game = Game.get_game_from_redis(data['joining_code'])
-            game.is_started = True
-            game.commit_to_redis()
-        emit('lobby/game-started', {}, to=data['joining_code'])
+        game = Game.get_game_from_redis(data['joining_code'])
+        game.start()
+        game.commit_to_redis()
+        return
     flash(f'Failed to start game: {response.json()["detail"]}')
 
 
@@ -247,9 +304,8 @@ def lobby_on_cancel_game(data):
     response = make_backend_request('post', f'games/{data["joining_code"]}/cancel')
     if response.status_code == 200:
         flash('Game cancelled successfully')
-        with game_access_lock:
-            Game.delete_game_from_redis(data['joining_code'])
-        emit('lobby/game-cancelled', {}, to=data['joining_code'])
+        Game.delete_game_from_redis(data['joining_code'])
+        return
     flash(f'Failed to cancel game: {response.json()["detail"]}')
 
 
@@ -258,7 +314,7 @@ def game_on_join(data):
     join_room(data['joining_code'])
     emit('game/player-joined', to=data['joining_code'])
 
-    with game_access_lock:
+    with Game.lock(data['joining_code']):
         game = Game.get_game_from_redis(data['joining_code'])
         game.add_in_game_player(session['user_id'])
         game.commit_to_redis()
@@ -266,64 +322,77 @@ def game_on_join(data):
             emit('game/start', to=data['joining_code'])
 
 
-@socket_app.on('game/next-question')
-def game_on_next_question(data):
-    room = data['joining_code']
+def start_round(room, session_id, previous_round):
+    with Game.lock(room):
+        game = Game.get_game_from_redis(room)
+        if game.round != previous_round:
+            return
+        try:
+            game.next_question(session_id)
+        except ValueError:
+            game.commit_to_redis()
+            socket_app.emit('game/end', to=room)
+            return
+        game.start_round(ROUND_SECONDS)
+        game.commit_to_redis()
+
+    question = game.current_question['question']
+    answers = game.current_question['answers']
+    socket_app.emit('game/question', {'question': question, 'answers': answers, 'seconds': ROUND_SECONDS}, to=room)
+    socket_app.start_background_task(end_round, room, session_id, game.round, game.round_deadline)
+
 
+def end_round(room, session_id, round_number, deadline):
+    # Rounds run on the server's clock, answers are scored in one batch at the deadline
+    socket_app.sleep(max(0, deadline - time.time()) + ANSWER_GRACE_SECONDS)
     try:
-        with game_access_lock:
-            game = Game.get_game_from_redis(room)
-            game.next_question()
-            game.commit_to_redis()
+        game = Game.get_game_from_redis(room)
+    except KeyError:
+        return
+    correct_answer = Game.score_round(room, round_number, deadline, game.current_question)
+    # One broadcast per room per round carries everything clients need
+    socket_app.emit(
+        'game/round-end',
+        {'correct_answer': correct_answer, 'scores': Game.get_scoreboard(room, game.player_names)},
+        to=room
+    )
+
+    socket_app.sleep(REVEAL_SECONDS)
+    try:
+        start_round(room, session_id, round_number)
+    except KeyError:
+        return
 
-            question = game.current_question['question']
-            answers = game.current_question['answers']
 
-            emit('game/question', {'question': question, 'answers': answers}, to=room)
-    except ValueError:
-        with game_access_lock:
-            game = Game.get_game_from_redis(room)
-            game.is_finished = True
-            game.commit_to_redis()
-        emit('game/end', to=room)
+@socket_app.on('game/next-question')
+def game_on_next_question(data):
+    # Only starts the first round, the server advances every round after that
+    game = Game.get_game_from_redis(data['joining_code'])
+    if game.host_player == session['user_id']:
+        start_round(data['joining_code'], session['session_id'], 0)
 
 
 @socket_app.on('game/answer')
 def game_on_answer(data):
-    room = data['joining_code']
-    print('answer', data)
-    with game_access_lock:
-        game = Game.get_game_from_redis(room)
-        correct_answer_idx = game.current_question['correct_answer']
-        correct_answer = game.current_question['answers'][correct_answer_idx]
-
-        if data['answer'] == correct_answer:
-            answer_score = min(10, int(data['time_left']))
-            game.current_scores[str(session['user_id'])] += answer_score
-            game.commit_to_redis()
+    Game.record_answer(data['joining_code'], session['user_id'], data['answer'])
 
 
+# The two handlers below reply to the requesting client only, the room as a
+# whole already gets the answer and scores in game/round-end
 @socket_app.on('game/request-answer')
 def game_on_request_answer(data):
-    room = data['joining_code']
-    with game_access_lock:
-        game = Game.get_game_from_redis(room)
-        correct_answer_idx = game.current_question['correct_answer']
-        correct_answer = game.current_question['answers'][correct_answer_idx]
-        emit('game/correct-answer', correct_answer, to=room)
+    game = Game.get_game_from_redis(data['joining_code'])
+    # Until the deadline the answer would tell any client what to answer
+    if game.round_deadline is None or time.time() < game.round_deadline:
+        return
+    correct_answer_idx = game.current_question['correct_answer']
+    correct_answer = game.current_question['answers'][correct_answer_idx]
+    emit('game/correct-answer', correct_answer)
 
 
 @socket_app.on('game/request-scores')
 def game_on_request_scores(data):
-    room = data['joining_code']
-    backend_game = make_backend_request('get', f'games/{data["joining_code"]}').json()
-    user_id_to_name = {
-        player['id']: player['user_name'] for player in backend_game['players']
-    }
-    with game_access_lock:
-        game = Game.get_game_from_redis(room)
-        scores = [{'name': user_id_to_name[int(user_id)], 'score': score} for user_id, score in game.current_scores.items()]
-        emit('game/scores', scores, to=room)
+    emit('game/scores', Game.get_scoreboard(data['joining_code']))
 
 
 if __name__ == '__main__':
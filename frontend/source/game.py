@@ -1,77 +1,210 @@
 import json
+import time
 import redis
 from settings import get_settings
 from utils import make_backend_request
 
 
 settings = get_settings()
+redis_pool = redis.ConnectionPool(
+    host=settings.REDIS_HOST,
+    port=settings.REDIS_PORT,
+    password=settings.REDIS_PASSWORD,
+    db=settings.REDIS_DB
+)
+GAME_TTL = 3600
+GAME_LOCK_TIMEOUT = 10
+SCOREBOARD_CACHE_MS = 1000
+
+# Scalar game attributes, each stored JSON encoded in its own hash field
+GAME_FIELDS = (
+    'joining_code',
+    'max_players',
+    'host_player',
+    'current_question',
+    'is_started',
+    'is_finished',
+    'total_questions',
+    'selected_category',
+    'difficulty',
+    'round',
+    'round_deadline'
+)
+PLAYER_PREFIX = 'player/'
+IN_GAME_PREFIX = 'in_game/'
+
+# Appends an answer to the buffer for the game's current round, the whole
+# buffer is scored in one go when the round's deadline passes
+RECORD_ANSWER_SCRIPT = """
+local round = redis.call('HGET', KEYS[1], 'round')
+if not round then
+    return false
+end
+local key = KEYS[2] .. '/' .. round
+redis.call('RPUSH', key, ARGV[1])
+redis.call('EXPIRE', key, ARGV[2])
+return round
+"""
+
+
+def get_redis():
+    return redis.Redis(connection_pool=redis_pool)
+
+
+record_answer_script = get_redis().register_script(RECORD_ANSWER_SCRIPT)
+
+
+def game_key(joining_code):
+    return f'games/{joining_code}'
+
+
+def scores_key(joining_code):
+    return f'scores/{joining_code}'
+
+
+def answers_key(joining_code):
+    return f'answers/{joining_code}'
 
 
 class Game:
 
     @staticmethod
-    def get_games_from_redis():
-        r = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            password=settings.REDIS_PASSWORD,
-            db=settings.REDIS_DB
+    def lock(joining_code):
+        # Lease based lock, so a crashed worker cannot hold a game forever
+        return get_redis().lock(
+            f'locks/games/{joining_code}',
+            timeout=GAME_LOCK_TIMEOUT,
+            blocking_timeout=GAME_LOCK_TIMEOUT
         )
-        game_keys = r.keys('games/*')
-        games = []
-        for game_key in game_keys:
-            games.append(Game.from_json(r.get(game_key)))
-        return games
-    
+
+    @staticmethod
+    def get_games_from_redis():
+        r = get_redis()
+        joining_codes = [
+            key.decode()[len('games/'):] for key in r.scan_iter('games/*', _type='hash')
+        ]
+        with r.pipeline(transaction=False) as pipe:
+            for joining_code in joining_codes:
+                pipe.hgetall(game_key(joining_code))
+                pipe.zrange(scores_key(joining_code), 0, -1, withscores=True)
+            results = pipe.execute()
+        return [
+            Game.from_hash(fields, scores)
+            for fields, scores in zip(results[::2], results[1::2]) if fields
+        ]
+
     @staticmethod
     def get_game_from_redis(joining_code):
-        r = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            password=settings.REDIS_PASSWORD,
-            db=settings.REDIS_DB
-        )
-        game_key = f'games/{joining_code}'
-        if r.exists(game_key):
-            return Game.from_json(r.get(game_key))
+        with get_redis().pipeline(transaction=False) as pipe:
+            pipe.hgetall(game_key(joining_code))
+            pipe.zrange(scores_key(joining_code), 0, -1, withscores=True)
+            fields, scores = pipe.execute()
+        if fields:
+            return Game.from_hash(fields, scores)
         raise KeyError(f'Game with joining code {joining_code} does not exist')
-    
+
     @staticmethod
     def delete_game_from_redis(joining_code):
-        r = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            password=settings.REDIS_PASSWORD,
-            db=settings.REDIS_DB
-        )
-        game_key = f'games/{joining_code}'
-        if r.exists(game_key):
-            r.delete(game_key)
+        if get_redis().delete(game_key(joining_code), scores_key(joining_code)):
             return
         raise KeyError(f'Game with joining code {joining_code} does not exist')
 
-    def __init__(self, joining_code, max_players, host_player, question_count, selected_category, difficulty):
+    @staticmethod
+    def get_scoreboard(joining_code, player_names=None):
+        # Repeated requests within SCOREBOARD_CACHE_MS share one computed scoreboard
+        r = get_redis()
+        scoreboard_key = f'scoreboard/{joining_code}'
+        if player_names is None:
+            cached = r.get(scoreboard_key)
+            if cached:
+                return json.loads(cached)
+            player_names = Game.get_game_from_redis(joining_code).player_names
+        scoreboard = [
+            {'name': player_names.get(user_id), 'score': score}
+            for user_id, score in Game.get_rankings(joining_code)
+        ]
+        r.set(scoreboard_key, json.dumps(scoreboard), px=SCOREBOARD_CACHE_MS)
+        return scoreboard
+
+    @staticmethod
+    def record_answer(joining_code, player, answer):
+        entry = json.dumps({'player': str(player), 'answer': answer, 'answered_at': time.time()})
+        return record_answer_script(
+            keys=[game_key(joining_code), answers_key(joining_code)],
+            args=[entry, GAME_TTL]
+        )
+
+    @staticmethod
+    def score_round(joining_code, round_number, deadline, question):
+        r = get_redis()
+        key = f'{answers_key(joining_code)}/{round_number}'
+        with r.pipeline() as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.delete(key)
+            answers, _ = pipe.execute()
+
+        # Only a player's first answer before the deadline counts
+        correct_answer = question['answers'][question['correct_answer']]
+        round_scores = {}
+        for entry in map(json.loads, answers):
+            if entry['player'] in round_scores or entry['answered_at'] > deadline:
+                continue
+            if entry['answer'] == correct_answer:
+                round_scores[entry['player']] = min(10, int(deadline - entry['answered_at']))
+            else:
+                round_scores[entry['player']] = 0
+
+        with r.pipeline(transaction=False) as pipe:
+            for player, score in round_scores.items():
+                if score > 0:
+                    pipe.zincrby(scores_key(joining_code), score, player)
+            pipe.expire(scores_key(joining_code), GAME_TTL)
+            pipe.execute()
+        return correct_answer
+
+    @staticmethod
+    def get_rankings(joining_code):
+        return [
+            (user_id.decode(), int(score))
+            for user_id, score in get_redis().zrevrange(scores_key(joining_code), 0, -1, withscores=True)
+        ]
+
+    def __init__(self, joining_code, max_players, host_player, question_count, selected_category, difficulty, host_name=None):
         self.joining_code = joining_code
         self.max_players = max_players
         self.host_player = host_player
         self.players = [host_player]
+        self.player_names = {str(host_player): host_name}
         self.in_game_players = []
-        self.used_questions = []
         self.current_question = None
-        self.current_scores = {host_player: 0}
+        self.current_scores = {str(host_player): 0}
         self.is_started = False
         self.is_finished = False
         self.total_questions = question_count
         self.selected_category = selected_category
         self.difficulty = difficulty
+        self.round = 0
+        self.round_deadline = None
 
-    def next_question(self):
-        if self.current_question is not None:
-            self.used_questions.append(self.current_question)
-        if len(self.used_questions) >= int(self.total_questions):
-            self.is_finished = True
+        # Pending writes, flushed in a single round trip by commit_to_redis
+        self._changed_fields = {
+            field: json.dumps(getattr(self, field)) for field in GAME_FIELDS
+        }
+        self._changed_fields[f'{PLAYER_PREFIX}{host_player}'] = json.dumps(host_name)
+        self._removed_fields = set()
+        self._new_players = [host_player]
+        self._removed_players = []
+
+    def _set(self, field, value):
+        setattr(self, field, value)
+        self._changed_fields[field] = json.dumps(value)
+
+    def next_question(self, session_id=None):
+        # Every round played so far used up one question
+        if self.round >= int(self.total_questions):
+            self._set('is_finished', True)
             raise ValueError('Game is finished')
-        
+
         params = {
             'game_code': self.joining_code,
         }
@@ -80,65 +213,88 @@ class Game:
         if self.difficulty:
             params['difficulty'] = self.difficulty
 
-        response = make_backend_request('get', 'questions/', params=params)
+        response = make_backend_request('get', 'questions/', params=params, session_id=session_id)
         if response.status_code == 200:
-            self.current_question = response.json()
+            self._set('current_question', response.json())
         else:
             print(response.text)
-    
-    def add_player(self, player):
+
+    def start(self):
+        self._set('is_started', True)
+
+    def start_round(self, seconds):
+        self._set('round', self.round + 1)
+        self._set('round_deadline', time.time() + seconds)
+
+    def add_player(self, player, name=None):
         self.players.append(player)
-        self.current_scores[player] = 0
+        self.player_names[str(player)] = name
+        self.current_scores[str(player)] = 0
+        self._changed_fields[f'{PLAYER_PREFIX}{player}'] = json.dumps(name)
+        self._new_players.append(player)
 
     def add_in_game_player(self, player):
         self.in_game_players.append(player)
-    
+        self._changed_fields[f'{IN_GAME_PREFIX}{player}'] = 1
+
     def remove_player(self, player):
         self.players.remove(player)
+        self.player_names.pop(str(player), None)
+        self.current_scores.pop(str(player), None)
+        self._changed_fields.pop(f'{PLAYER_PREFIX}{player}', None)
+        self._removed_fields.add(f'{PLAYER_PREFIX}{player}')
+        if player in self._new_players:
+            self._new_players.remove(player)
+        self._removed_players.append(player)
 
     def commit_to_redis(self):
-        r = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            password=settings.REDIS_PASSWORD,
-            db=settings.REDIS_DB
-        )
-        r.set(f'games/{self.joining_code}', json.dumps(self.to_json()))
-        r.expire(f'games/{self.joining_code}', 3600)
-    
-    def to_json(self):
-        return {
-            'joining_code': self.joining_code,
-            'max_players': self.max_players,
-            'host_player': self.host_player,
-            'players': self.players,
-            'used_questions': self.used_questions,
-            'current_question': self.current_question,
-            'current_scores': self.current_scores,
-            'is_started': self.is_started,
-            'is_finished': self.is_finished,
-            'in_game_players': self.in_game_players,
-            'total_questions': self.total_questions,
-            'selected_category': self.selected_category,
-            'difficulty': self.difficulty
-        }
-    
+        key = game_key(self.joining_code)
+        with get_redis().pipeline() as pipe:
+            if self._removed_fields:
+                pipe.hdel(key, *self._removed_fields)
+            if self._changed_fields:
+                pipe.hset(key, mapping=self._changed_fields)
+            # A departed player leaves the scoreboard too, or rankings would
+            # still name them and could pick them as the winner
+            if self._removed_players:
+                pipe.zrem(scores_key(self.joining_code), *self._removed_players)
+            if self._new_players:
+                pipe.zadd(scores_key(self.joining_code), {player: 0 for player in self._new_players}, nx=True)
+                pipe.expire(scores_key(self.joining_code), GAME_TTL)
+            pipe.expire(key, GAME_TTL)
+            pipe.execute()
+        self._changed_fields = {}
+        self._removed_fields = set()
+        self._new_players = []
+        self._removed_players = []
+
     @classmethod
-    def from_json(cls, json_string):
-        json_data = json.loads(json_string)
+    def from_hash(cls, fields, scores):
+        fields = {field.decode(): value for field, value in fields.items()}
+        values = {field: json.loads(fields[field]) for field in GAME_FIELDS if field in fields}
         base = cls(
-            json_data['joining_code'],
-            json_data['max_players'],
-            json_data['host_player'],
-            json_data['total_questions'],
-            json_data['selected_category'],
-            json_data['difficulty']
+            values['joining_code'],
+            values['max_players'],
+            values['host_player'],
+            values['total_questions'],
+            values['selected_category'],
+            values['difficulty']
         )
-        base.players = json_data['players']
-        base.used_questions = json_data['used_questions']
-        base.current_question = json_data['current_question']
-        base.current_scores = json_data['current_scores']
-        base.is_started = json_data['is_started']
-        base.is_finished = json_data['is_finished']
-        base.in_game_players = json_data['in_game_players']
+        base.current_question = values['current_question']
+        base.is_started = values['is_started']
+        base.is_finished = values['is_finished']
+        base.round = values.get('round', 0)
+        base.round_deadline = values.get('round_deadline')
+        base.players = []
+        base.player_names = {}
+        base.in_game_players = []
+        base.current_scores = {user_id.decode(): int(score) for user_id, score in scores}
+        for field, value in fields.items():
+            if field.startswith(PLAYER_PREFIX):
+                base.players.append(int(field[len(PLAYER_PREFIX):]))
+                base.player_names[field[len(PLAYER_PREFIX):]] = json.loads(value)
+            elif field.startswith(IN_GAME_PREFIX):
+                base.in_game_players.append(int(field[len(IN_GAME_PREFIX):]))
+        base._changed_fields = {}
+        base._new_players = []
         return base
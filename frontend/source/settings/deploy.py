@@ -13,4 +13,22 @@ REDIS_DB  = os.getenv("REDIS_DB")
 
 
 # Backend settings
-BACKEND_URL = os.getenv("BACKEND_URL")
\ No newline at end of file
+BACKEND_URL = os.getenv("BACKEND_URL")
+BACKEND_TIMEOUT = os.getenv("BACKEND_TIMEOUT", "10")
+BACKEND_RETRIES = os.getenv("BACKEND_RETRIES", "2")
+BACKEND_POOL_SIZE = os.getenv("BACKEND_POOL_SIZE", "20")
+
+
+# Socket.IO settings
+# Every worker publishes room broadcasts through this queue, so they reach
+# clients connected to any other worker
+SOCKETIO_ASYNC_MODE  = os.getenv("SOCKETIO_ASYNC_MODE", "gevent")
+SOCKETIO_MESSAGE_QUEUE  = os.getenv(
+    "SOCKETIO_MESSAGE_QUEUE",
+    f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
+)
+
+
+# Game settings
+ROUND_SECONDS  = os.getenv("ROUND_SECONDS", "15")
+REVEAL_SECONDS  = os.getenv("REVEAL_SECONDS", "5")
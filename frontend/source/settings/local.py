@@ -16,3 +16,18 @@ REDIS_DB  = "0"
 
 # Backend settings
 BACKEND_URL = "http://localhost:8000"
+BACKEND_TIMEOUT = os.getenv("BACKEND_TIMEOUT", "10")
+BACKEND_RETRIES = os.getenv("BACKEND_RETRIES", "2")
+BACKEND_POOL_SIZE = os.getenv("BACKEND_POOL_SIZE", "20")
+
+
+# Socket.IO settings
+# Left unset, Flask-SocketIO would pick gevent whenever it is installed, without
+# the monkey patching app.py only applies when gevent is asked for by name
+SOCKETIO_ASYNC_MODE  = os.getenv("SOCKETIO_ASYNC_MODE", "threading")
+SOCKETIO_MESSAGE_QUEUE  = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+
+
+# Game settings
+ROUND_SECONDS  = os.getenv("ROUND_SECONDS", "15")
+REVEAL_SECONDS  = os.getenv("REVEAL_SECONDS", "5")
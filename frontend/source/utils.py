@@ -1,11 +1,35 @@
 import os
 from functools import wraps
-from flask import session, flash, render_template
+from flask import g, has_app_context, session, flash, render_template
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from settings import get_settings
 
 
 settings = get_settings()
+BACKEND_TIMEOUT = float(settings.BACKEND_TIMEOUT)
+
+backend_session = requests.Session()
+backend_session.mount(settings.BACKEND_URL, HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=int(settings.BACKEND_POOL_SIZE),
+    # Only idempotent requests are retried
+    max_retries=Retry(
+        total=int(settings.BACKEND_RETRIES),
+        backoff_factor=0.1,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'PUT', 'DELETE']),
+        raise_on_status=False
+    )
+))
+# GET questions/?game_code=... pops the game's next question, so a retry after
+# a 503 could use up a question nobody sees. The longer prefix takes precedence
+backend_session.mount(os.path.join(settings.BACKEND_URL, 'questions/?'), HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=int(settings.BACKEND_POOL_SIZE),
+    max_retries=0
+))
 
 
 def login_required(func):
@@ -18,46 +42,44 @@ def login_required(func):
     return wrapper
 
 
-def make_backend_request(method, path, data=None, auth=True, params=None):
+def make_backend_request(method, path, data=None, auth=True, params=None, session_id=None):
     if auth:
-        return make_backend_request_with_auth(method, path, data, params)
+        return make_backend_request_with_auth(method, path, data, params, session_id)
     else:
         return make_backend_request_without_auth(method, path, data, params)
 
 
-def make_backend_request_without_auth(method, path, data=None, params=None):
-    methods = {
-        'post': requests.post,
-        'get': requests.get,
-        'put': requests.put,
-        'delete': requests.delete
-    }
-    try:
-        method = methods[method]
-    except KeyError:
+def _send_backend_request(method, path, data=None, headers=None, params=None):
+    if method not in ('post', 'get', 'put', 'delete'):
         raise AttributeError('Unkown request type')
-    
+
+    # GETs are memoized for the rest of the current request or socket event
+    cache = g.setdefault('backend_responses', {}) if has_app_context() else None
+    cache_key = (path, tuple(sorted((params or {}).items())), tuple(sorted((headers or {}).items())))
+    if method == 'get' and cache is not None and cache_key in cache:
+        return cache[cache_key]
+
     url = os.path.join(settings.BACKEND_URL, path)
-    response = method(url, json=data, params=params)
+    response = backend_session.request(
+        method, url, json=data, headers=headers, params=params, timeout=BACKEND_TIMEOUT
+    )
+    if cache is not None:
+        g.backend_calls = g.get('backend_calls', 0) + 1
+        if method == 'get':
+            cache[cache_key] = response
+        else:
+            # A write can change what the backend returns for any earlier GET
+            cache.clear()
     return response
 
 
-def make_backend_request_with_auth(method, path, data=None, params=None):
-    methods = {
-        'post': requests.post,
-        'get': requests.get,
-        'put': requests.put,
-        'delete': requests.delete
-    }
-    try:
-        method = methods[method]
-    except KeyError:
-        raise AttributeError('Unkown request type')
-    
+def make_backend_request_without_auth(method, path, data=None, params=None):
+    return _send_backend_request(method, path, data, params=params)
+
+
+def make_backend_request_with_auth(method, path, data=None, params=None, session_id=None):
+    # Background tasks have no flask session, they pass the session id explicitly
     headers = {
-        'session-id': session['session_id']
+        'session-id': session_id or session['session_id']
     }
-
-    url = os.path.join(settings.BACKEND_URL, path)
-    response = method(url, json=data, headers=headers, params=params)
-    return response
\ No newline at end of file
+    return _send_backend_request(method, path, data, headers=headers, params=params)
@@ -0,0 +1,18 @@
+import os
+import socket
+import sys
+import pytest
+
+
+# Short rounds on plain threads, so a whole game plays out in a few seconds.
+# Game state lives in a real Redis on localhost
+os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'threading')
+os.environ.setdefault('ROUND_SECONDS', '1')
+os.environ.setdefault('REVEAL_SECONDS', '0')
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'frontend', 'source'))
+
+try:
+    socket.create_connection(('localhost', 6379), timeout=1).close()
+except OSError:
+    pytest.skip('Redis needs to be running on localhost', allow_module_level=True)
@@ -0,0 +1,102 @@
+import threading
+import time
+import uuid
+import pytest
+from flask import Flask
+from flask_socketio import SocketIO
+import app as frontend
+from game import Game, get_redis, scores_key
+
+
+def test_idle_lobby_listener_lets_other_tasks_run(monkeypatch):
+    # gevent with nothing monkey patched, so a listener that blocks on its
+    # Redis connection would hold up every other greenlet
+    socket_app = SocketIO(Flask(__name__), async_mode='gevent')
+    monkeypatch.setattr(frontend, 'socket_app', socket_app)
+    monkeypatch.setattr(frontend, 'LOBBY_LISTEN_SECONDS', 2)
+    joining_code = f'test-{uuid.uuid4().hex[:8]}'
+    sid = socket_app.server.manager.connect('viewer', '/')
+    socket_app.server.manager.enter_room(sid, '/', joining_code)
+    frontend.lobby_listeners.add(joining_code)
+    ticked = []
+
+    def tick():
+        for _ in range(10):
+            socket_app.sleep(0.1)
+
+    def play():
+        listener = socket_app.start_background_task(frontend.forward_lobby_events, joining_code)
+        started = time.monotonic()
+        socket_app.start_background_task(tick).join()
+        ticked.append(time.monotonic() - started)
+
+        # Once the room empties the listener stops at its next check
+        socket_app.server.manager.leave_room(sid, '/', joining_code)
+        listener.join(5)
+
+    # On a thread of its own, a listener that never yields fails the test
+    # instead of hanging it
+    thread = threading.Thread(target=play, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert ticked and ticked[0] < 1.5
+    assert joining_code not in frontend.lobby_listeners
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {}
+
+
+@pytest.fixture
+def backend_calls(monkeypatch):
+    calls = []
+
+    def fake_backend_request(method, path, data=None, auth=True, params=None, session_id=None):
+        calls.append((method, path, data))
+        return FakeResponse()
+
+    monkeypatch.setattr(frontend, 'make_backend_request', fake_backend_request)
+    return calls
+
+
+def _client(player):
+    http = frontend.app.test_client()
+    with http.session_transaction() as session:
+        session['user_id'] = player
+        session['session_id'] = f'session-{player}'
+    return http
+
+
+def test_results_after_a_player_left_the_lobby(backend_calls):
+    joining_code = f'test-{uuid.uuid4().hex[:8]}'
+    game = Game(joining_code, 4, 1, 1, None, None, 'host')
+    game.add_player(2, 'stays')
+    game.add_player(3, 'leaves')
+    game.commit_to_redis()
+    # Ahead on points when leaving, so a leftover score would top the rankings
+    get_redis().zincrby(scores_key(joining_code), 10, 3)
+
+    leaving = _client(3)
+    socket = frontend.socket_app.test_client(frontend.app, flask_test_client=leaving)
+    assert socket.emit('lobby/leave', {'joining_code': joining_code}, callback=True)
+    socket.disconnect()
+
+    game = Game.get_game_from_redis(joining_code)
+    game.start()
+    game.start_round(0)
+    with pytest.raises(ValueError):
+        game.next_question()
+    game.commit_to_redis()
+
+    try:
+        response = _client(1).get(f'/game/{joining_code}/results')
+        assert response.status_code == 200
+        assert b'leaves' not in response.data
+        # Any player still in the game can win the tie, but never the one who left
+        [winner] = [data['winner'] for _, path, data in backend_calls if path == f'games/{joining_code}/end']
+        assert winner in (1, 2)
+    finally:
+        Game.delete_game_from_redis(joining_code)
@@ -0,0 +1,119 @@
+import time
+import uuid
+from collections import Counter
+import pytest
+import game
+from app import app, socket_app
+from game import Game
+
+
+PLAYERS = 8
+QUESTIONS = 3
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def fake_backend_request(method, path, data=None, auth=True, params=None, session_id=None):
+    number = uuid.uuid4().hex[:8]
+    return FakeResponse({
+        'question': f'Question {number}?',
+        'answers': [f'Right {number}', f'Wrong {number}'],
+        'correct_answer': 0,
+        'category_name': 'Test'
+    })
+
+
+@pytest.fixture
+def room(monkeypatch):
+    monkeypatch.setattr(game, 'make_backend_request', fake_backend_request)
+    joining_code = f'test-{uuid.uuid4().hex[:8]}'
+    players = list(range(1, PLAYERS + 1))
+    new_game = Game(joining_code, PLAYERS, players[0], QUESTIONS, None, None, 'player-1')
+    for player in players[1:]:
+        new_game.add_player(player, f'player-{player}')
+    new_game.start()
+    new_game.commit_to_redis()
+
+    clients = []
+    for player in players:
+        http = app.test_client()
+        with http.session_transaction() as session:
+            session['user_id'] = player
+            session['session_id'] = f'session-{player}'
+        clients.append(socket_app.test_client(app, flask_test_client=http))
+    yield joining_code, clients
+
+    for client in clients:
+        client.disconnect()
+    Game.delete_game_from_redis(joining_code)
+
+
+def wait_for(clients, received, event, count, timeout=10):
+    # Until every client has received the event count times
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for client, messages in zip(clients, received):
+            messages.extend(client.get_received())
+        if all(sum(message['name'] == event for message in messages) >= count for messages in received):
+            return
+        time.sleep(0.01)
+    raise AssertionError(f'Not every client received {event} {count} times')
+
+
+def test_round_messages_grow_linearly_with_players(room):
+    joining_code, clients = room
+    received = [[] for _ in clients]
+    for client in clients:
+        client.emit('game/join', {'joining_code': joining_code})
+    wait_for(clients, received, 'game/start', 1)
+
+    clients[0].emit('game/next-question', {'joining_code': joining_code})
+    for round_number in range(1, QUESTIONS + 1):
+        wait_for(clients, received, 'game/question', round_number)
+        for client, messages in zip(clients, received):
+            question = [message for message in messages if message['name'] == 'game/question'][-1]
+            client.emit('game/answer', {'joining_code': joining_code, 'answer': question['args'][0]['answers'][0]})
+
+        wait_for(clients, received, 'game/round-end', round_number)
+        for client in clients:
+            client.emit('game/request-scores', {'joining_code': joining_code})
+        wait_for(clients, received, 'game/scores', round_number)
+    wait_for(clients, received, 'game/end', 1)
+
+    # Each round reaches every player once, and a scores request is answered
+    # to the player who asked, so a room costs O(N) messages per round
+    for messages in received:
+        counts = Counter(message['name'] for message in messages)
+        assert counts['game/question'] == QUESTIONS
+        assert counts['game/round-end'] == QUESTIONS
+        assert counts['game/scores'] == QUESTIONS
+        assert counts['game/end'] == 1
+
+        round_end = [message for message in messages if message['name'] == 'game/round-end'][-1]
+        assert len(round_end['args'][0]['scores']) == PLAYERS
+
+
+def test_correct_answer_is_withheld_until_the_deadline(room):
+    joining_code, clients = room
+    game = Game.get_game_from_redis(joining_code)
+    game.next_question()
+    game.start_round(60)
+    game.commit_to_redis()
+    correct_answer = game.current_question['answers'][game.current_question['correct_answer']]
+
+    clients[1].emit('game/request-answer', {'joining_code': joining_code})
+    assert [message for message in clients[1].get_received() if message['name'] == 'game/correct-answer'] == []
+
+    game.start_round(-1)
+    game.commit_to_redis()
+    clients[1].emit('game/request-answer', {'joining_code': joining_code})
+    answers = [message['args'][0] for message in clients[1].get_received() if message['name'] == 'game/correct-answer']
+    assert answers == [correct_answer]
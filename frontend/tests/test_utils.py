@@ -0,0 +1,15 @@
+import os
+import requests
+from utils import backend_session, settings
+
+
+def _retries(path, params=None):
+    url = requests.Request('GET', os.path.join(settings.BACKEND_URL, path), params=params).prepare().url
+    return backend_session.get_adapter(url).max_retries.total
+
+
+def test_question_pop_is_never_retried():
+    # Popping a question again after a 503 would skip one for the whole game
+    assert _retries('questions/', {'game_code': 'abc', 'category': 9}) == 0
+    assert _retries('questions/categories/') == int(settings.BACKEND_RETRIES)
+    assert _retries('games/abc') == int(settings.BACKEND_RETRIES)
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sys
+
+
+# For the benchmarks and backend tests that drive backend code in process.
+# They get a database of their own, so its tables can be filled and emptied
+# freely. Import this before any backend module, the backend reads its
+# settings on import
+os.environ.setdefault('DB_NAME', 'dtrivia-bench')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'source'))
+
+
+async def create_database():
+    import asyncpg
+    from settings import get_settings
+
+    settings = get_settings()
+    conn = await asyncpg.connect(
+        host=settings.DB_HOST,
+        port=settings.DB_PORT,
+        user=settings.DB_USER,
+        password=settings.DB_PASSWORD,
+        database='postgres'
+    )
+    try:
+        if not await conn.fetchval('SELECT 1 FROM pg_database WHERE datname = $1', settings.DB_NAME):
+            await conn.execute(f'CREATE DATABASE "{settings.DB_NAME}"')
+    finally:
+        await conn.close()
+
+
+async def create_tables():
+    import app  # noqa: F401, registers every model
+    from db import Base, engine, lock_schema
+    from game import migrations as game_migrations
+    from users import migrations as user_migrations
+
+    async with engine.begin() as conn:
+        await lock_schema(conn)
+        await conn.run_sync(Base.metadata.create_all)
+        await user_migrations.upgrade(conn)
+        await game_migrations.upgrade(conn)
+
+
+def run(coroutine):
+    # Creates the database and tables if needed, then runs the benchmark and
+    # closes every connection before the loop goes away
+    from db import engine
+    from users.session import redis
+
+    async def main():
+        await create_database()
+        await create_tables()
+        try:
+            return await coroutine
+        finally:
+            await engine.dispose()
+            await redis.connection_pool.disconnect()
+    return asyncio.run(main())
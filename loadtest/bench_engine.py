@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+import psutil
+import requests
+import websocket
+from run import (
+    BACKEND_URL, LoadTestError, Player, Recorder, Room, enter_game, git_commit, parse_args, start_servers,
+    stop_servers, write_report
+)
+
+
+class EnginePlayer:
+    # Talks to the backend directly, and plays over the engine's websocket
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.socket = None
+        self.inbox = defaultdict(queue.Queue)
+
+    def request(self, method, path, **kwargs):
+        response = self.http.request(method, BACKEND_URL + path, timeout=self.timeout, **kwargs)
+        if response.status_code >= 400:
+            raise LoadTestError(f'{self.name}: {method.upper()} {path} returned {response.status_code}')
+        return response.json()
+
+    def connect(self, joining_code, session_id):
+        url = BACKEND_URL.replace('http', 'ws', 1)
+        self.socket = websocket.create_connection(
+            f'{url}/games/{joining_code}/play?session_id={session_id}', timeout=self.timeout
+        )
+        threading.Thread(target=self._receive, daemon=True).start()
+
+    def _receive(self):
+        try:
+            while True:
+                message = json.loads(self.socket.recv())
+                self.inbox[message['type']].put((time.perf_counter(), message))
+        except (websocket.WebSocketException, OSError, ValueError):
+            return
+
+    def send(self, message):
+        self.socket.send(json.dumps(message))
+
+    def expect(self, *types, timeout=None):
+        deadline = time.perf_counter() + (timeout or self.timeout)
+        while time.perf_counter() < deadline:
+            for message_type in types:
+                try:
+                    received_at, message = self.inbox[message_type].get_nowait()
+                    return message_type, received_at, message
+                except queue.Empty:
+                    pass
+            time.sleep(0.005)
+        raise LoadTestError(f'{self.name} timed out waiting for {types}')
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+
+
+def enter_engine_game(player, room, is_host, args):
+    password = uuid.uuid4().hex
+    player.request('post', '/users/', json={
+        'user_name': player.name,
+        'email': f'{player.name}@loadtest.invalid',
+        'password': password
+    })
+    user = player.request('post', '/users/login', json={'user_name': player.name, 'password': password})
+    player.http.headers['session-id'] = user['session_id']
+
+    if is_host:
+        game = player.request('post', '/games/', json={'host_player': user['id'], 'max_players': args.players})
+        room.joining_code = game['joining_code']
+        room.created.set()
+    else:
+        if not room.created.wait(player.timeout):
+            raise LoadTestError(f'{player.name} timed out waiting for the game')
+        player.request('post', f'/games/{room.joining_code}/join')
+    room.barrier.wait(player.timeout)
+
+    if is_host:
+        player.request('post', f'/games/{room.joining_code}/start', json={'total_questions': args.questions})
+    room.barrier.wait(player.timeout)
+    player.connect(room.joining_code, user['session_id'])
+    # Every player listens before the first question goes out
+    room.barrier.wait(player.timeout)
+    return room.joining_code
+
+
+def play_relay(player, room, is_host, args, recorder, window):
+    # Rounds run on the frontend's timer, and the next one starts as soon as
+    # the previous ends since the reveal is set to 0 seconds
+    code = enter_game(player, room, is_host, args)
+    window['start'].wait(player.timeout)
+    if is_host:
+        player.sio.emit('game/next-question', {'joining_code': code})
+
+    ended_at = None
+    while True:
+        event, received_at, question = player.expect('game/question', 'game/end', timeout=player.timeout * 2)
+        if ended_at is not None:
+            recorder.record('round', 'turnaround', received_at - ended_at)
+        if event == 'game/end':
+            break
+        player.sio.emit('game/answer', {'joining_code': code, 'answer': question['answers'][0]})
+        _, ended_at, _ = player.expect('game/round-end', timeout=player.timeout + question['seconds'])
+
+        sent_at = time.perf_counter()
+        player.sio.emit('game/request-scores', {'joining_code': code})
+        _, received_at, _ = player.expect('game/scores')
+        recorder.record('round', 'scores', received_at - sent_at)
+    window['end'].wait(player.timeout)
+    player.sio.disconnect()
+
+
+def play_engine(player, room, is_host, args, recorder, window):
+    # The host ends each round after the same number of seconds the relay
+    # waits, and asks for the next question as soon as it has ended
+    code = enter_engine_game(player, room, is_host, args)
+    window['start'].wait(player.timeout)
+    if is_host:
+        player.send({'type': 'next-question', 'round': 0})
+
+    ended_at = None
+    while True:
+        message_type, received_at, question = player.expect('question', 'end', timeout=player.timeout * 2)
+        if ended_at is not None:
+            recorder.record('round', 'turnaround', received_at - ended_at)
+        if message_type == 'end':
+            break
+        player.send({'type': 'answer', 'answer': question['answers'][0], 'round': question['round']})
+        if is_host:
+            time.sleep(question['seconds'])
+            player.send({'type': 'end-round'})
+        _, ended_at, _ = player.expect('round-end', timeout=player.timeout + question['seconds'])
+        if is_host:
+            player.send({'type': 'next-question', 'round': question['round']})
+
+        sent_at = time.perf_counter()
+        player.send({'type': 'request-scores'})
+        _, received_at, _ = player.expect('scores')
+        recorder.record('round', 'scores', received_at - sent_at)
+    window['end'].wait(player.timeout)
+    player.close()
+
+
+def cpu_seconds(processes):
+    # Every server process and its workers, Redis and Postgres are shared by
+    # both paths and left out
+    total = 0.0
+    for process in processes:
+        try:
+            process = psutil.Process(process.pid)
+            for member in [process, *process.children(recursive=True)]:
+                times = member.cpu_times()
+                total += times.user + times.system
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def measure(mode, rooms, args, processes):
+    recorder = Recorder()
+    failures = queue.Queue()
+    run_id = uuid.uuid4().hex[:8]
+    marks = {}
+
+    def mark(name):
+        marks[name] = (time.perf_counter(), cpu_seconds(processes))
+
+    # The rounds of every room are timed together, between two barriers that
+    # every player passes once its game is set up and once it has ended
+    parties = rooms * args.players
+    window = {
+        'start': threading.Barrier(parties, action=lambda: mark('start')),
+        'end': threading.Barrier(parties, action=lambda: mark('end'))
+    }
+    run_args = parse_args([
+        '--players', str(args.players),
+        '--questions', str(args.questions),
+        '--round-seconds', str(args.round_seconds),
+        '--timeout', str(args.timeout)
+    ])
+
+    def run_player(player, room, is_host):
+        try:
+            if mode == 'relay':
+                play_relay(player, room, is_host, run_args, recorder, window)
+            else:
+                play_engine(player, room, is_host, run_args, recorder, window)
+        except Exception as error:
+            room.barrier.abort()
+            room.created.set()
+            window['start'].abort()
+            window['end'].abort()
+            failures.put(f'{player.name}: {error!r}')
+
+    threads = []
+    for index in range(rooms):
+        room = Room(args.players)
+        for number in range(args.players):
+            name = f'bench-{run_id}-{index}-{number}'
+            if mode == 'relay':
+                player = Player(run_args.frontend_url, Recorder(), name, args.timeout)
+            else:
+                player = EnginePlayer(name, args.timeout)
+            threads.append(threading.Thread(target=run_player, args=(player, room, number == 0), daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failures = [failures.get() for _ in range(failures.qsize())]
+    if failures or 'end' not in marks:
+        return {'players_failed': len(failures), 'failures': failures[:20]}
+    duration = marks['end'][0] - marks['start'][0]
+    cpu = marks['end'][1] - marks['start'][1]
+    return {
+        'players_failed': 0,
+        'rounds_duration_s': round(duration, 3),
+        'server_cpu_s': round(cpu, 3),
+        # How many such rooms one fully busy core would carry
+        'rooms_per_core': round(rooms * duration / cpu, 1) if cpu else None,
+        **recorder.summary('round', duration)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rounds through the Flask relay against the backend game engine')
+    parser.add_argument('--rooms', type=int, nargs='+', default=[4, 16])
+    parser.add_argument('--players', type=int, default=4, help='players per game, including the host')
+    parser.add_argument('--questions', type=int, default=5)
+    parser.add_argument('--round-seconds', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--modes', nargs='+', choices=['relay', 'engine'], default=['relay', 'engine'])
+    parser.add_argument('--server-log', help='file for the started servers\' output')
+    parser.add_argument('--label', help='free form label stored with the results')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        # Both paths run against a freshly started stack, the engine only
+        # enabled for its own run
+        os.environ['GAME_ENGINE_ENABLED'] = '1' if mode == 'engine' else '0'
+        os.environ['GAME_ENGINE_ROUND_SECONDS'] = str(args.round_seconds)
+        server_args = ['--start', '--round-seconds', str(args.round_seconds), '--reveal-seconds', '0']
+        if args.server_log:
+            server_args += ['--server-log', args.server_log]
+        opentdb, processes = start_servers(parse_args(server_args))
+        try:
+            results[mode] = {str(rooms): measure(mode, rooms, args, processes) for rooms in args.rooms}
+        finally:
+            stop_servers(opentdb, processes)
+
+    write_report({
+        'commit': git_commit(),
+        'label': args.label,
+        'config': {
+            'players': args.players,
+            'questions': args.questions,
+            'round_seconds': args.round_seconds
+        },
+        **results
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import time
+import backend_env
+import httpx
+from sqlalchemy import select
+from app import app
+from db import SessionLocal
+from users import crud, models, schemas
+from run import Recorder, git_commit, write_report
+
+
+PASSWORD = 'bench-password'
+original_hash_password, original_verify_password = crud.hash_password, crud.verify_password
+
+
+async def inline_hash_password(password, salt, algorithm=crud.HASH_ALGORITHM, iterations=crud.HASH_ITERATIONS):
+    # What every login did before hashing moved to the executor
+    return hashlib.pbkdf2_hmac(algorithm, password.encode('utf-8'), salt, iterations)
+
+
+async def inline_verify_password(password, salt, hashed_password, algorithm, iterations):
+    return hmac.compare_digest(
+        await inline_hash_password(password, salt, algorithm, iterations),
+        hashed_password
+    )
+
+
+async def create_users(count):
+    async with SessionLocal() as db:
+        result = await db.execute(select(models.User.user_name).where(models.User.user_name.like('bench-login-%')))
+        existing = set(result.scalars().all())
+        for i in range(count):
+            user_name = f'bench-login-{i}'
+            if user_name not in existing:
+                await crud.create_user(db, schemas.UserCreate(
+                    user_name=user_name, email=f'{user_name}@bench.invalid', password=PASSWORD
+                ))
+
+
+async def login(client, recorder, kind, user_name):
+    with recorder.timed(kind, 'login'):
+        response = await client.post('/users/login', json={'user_name': user_name, 'password': PASSWORD})
+        response.raise_for_status()
+
+
+async def probe(client, recorder, kind, interval, storm):
+    # An unrelated endpoint polled for as long as the storm lasts, standing in
+    # for every game sharing the worker with the logins
+    while not storm.done():
+        with recorder.timed(kind, 'db_stats'):
+            response = await client.get('/db/stats')
+            response.raise_for_status()
+        await asyncio.sleep(interval)
+
+
+async def measure(args, recorder, kind):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited_login(client, user_name):
+        async with semaphore:
+            await login(client, recorder, kind, user_name)
+
+    async with httpx.AsyncClient(app=app, base_url='http://bench', timeout=120) as client:
+        started = time.perf_counter()
+        storm = asyncio.ensure_future(asyncio.gather(*(
+            limited_login(client, f'bench-login-{i % args.users}') for i in range(args.logins)
+        )))
+        await asyncio.gather(storm, probe(client, recorder, kind, args.probe_interval_ms / 1000, storm))
+        return time.perf_counter() - started
+
+
+async def benchmark(args, recorder):
+    await create_users(args.users)
+    durations = {}
+    for mode in args.modes:
+        if mode == 'inline':
+            crud.hash_password, crud.verify_password = inline_hash_password, inline_verify_password
+        durations[mode] = await measure(args, recorder, mode)
+        crud.hash_password, crud.verify_password = original_hash_password, original_verify_password
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Login throughput, and latency of an unrelated endpoint, during a login storm')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=50, help='logins in flight at once')
+    parser.add_argument('--probe-interval-ms', type=float, default=10.0)
+    parser.add_argument('--modes', nargs='+', choices=['executor', 'inline'], default=['executor', 'inline'])
+    parser.add_argument('--label', help='free form label stored with the results')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    durations = backend_env.run(benchmark(args, recorder))
+    write_report({
+        'commit': git_commit(),
+        'label': args.label,
+        'config': {
+            'users': args.users,
+            'logins': args.logins,
+            'concurrency': args.concurrency,
+            'probe_interval_ms': args.probe_interval_ms,
+            'hash_iterations': crud.HASH_ITERATIONS
+        },
+        **{
+            mode: {'duration_s': round(duration, 3), **recorder.summary(mode, duration)}
+            for mode, duration in durations.items()
+        }
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
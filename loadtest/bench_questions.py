@@ -0,0 +1,101 @@
+import argparse
+import random
+import time
+import backend_env
+from sqlalchemy import func, select, text
+from db import SessionLocal
+from questions import crud, models
+from run import Recorder, git_commit, write_report
+
+
+CATEGORIES = 10
+
+
+async def grow(db, size):
+    # Tops the question bank up to `size` rows, spread over the categories
+    categories = await db.execute(text(
+        "INSERT INTO categories (name, description) "
+        "SELECT 'Bench category ' || n, '' FROM generate_series(1, :count) n "
+        "ON CONFLICT (name) DO UPDATE SET description = excluded.description "
+        "RETURNING id"
+    ), {'count': CATEGORIES})
+    category_ids = categories.scalars().all()
+    current = await db.scalar(select(func.count()).select_from(models.Question))
+    if current < size:
+        await db.execute(text(
+            "INSERT INTO questions (question, category_id, answers, correct_answer, random_key) "
+            "SELECT 'Bench question ' || n || '?', (CAST(:category_ids AS INTEGER[]))[1 + n % :categories], "
+            "ARRAY['Right', 'Wrong 1', 'Wrong 2', 'Wrong 3'], 0, random() "
+            "FROM generate_series(CAST(:start AS INTEGER), CAST(:stop AS INTEGER)) n"
+        ), {'category_ids': category_ids, 'categories': len(category_ids), 'start': current + 1, 'stop': size})
+    await db.commit()
+    await db.execute(text('ANALYZE questions'))
+    return category_ids
+
+
+async def order_by_random(db, exclude_ids):
+    # What get_random_question did before sampling walked the random_key index
+    result = await db.execute(
+        select(models.Question.__table__)
+        .where(models.Question.id.notin_(exclude_ids))
+        .order_by(func.random())
+        .limit(1)
+    )
+    return result.first()
+
+
+async def benchmark(args, recorder):
+    async with SessionLocal() as db:
+        await db.execute(text('TRUNCATE questions, categories RESTART IDENTITY CASCADE'))
+        await db.commit()
+        for size in args.sizes:
+            category_ids = await grow(db, size)
+            kind = str(size)
+            # A game's exclude list grows by one question every round
+            exclude_ids = random.sample(range(1, size + 1), min(args.exclude, size))
+            for _ in range(args.samples):
+                with recorder.timed(kind, 'get_random_question'):
+                    await crud.get_random_question(db, exclude_ids, [])
+                with recorder.timed(kind, 'sample_questions'):
+                    await crud.sample_questions(
+                        db, args.per_category, category_ids=random.sample(category_ids, 3), exclude_ids=exclude_ids
+                    )
+            for _ in range(args.baseline_samples):
+                with recorder.timed(kind, 'order_by_random'):
+                    await order_by_random(db, exclude_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Question sampling latency as the question bank grows')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--samples', type=int, default=200, help='timed calls per sampling function and size')
+    parser.add_argument('--baseline-samples', type=int, default=20, help='timed ORDER BY random() calls per size')
+    parser.add_argument('--exclude', type=int, default=20, help='question ids excluded, as after that many rounds')
+    parser.add_argument('--per-category', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', help='free form label stored with the results')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    backend_env.run(benchmark(args, recorder))
+    duration = time.perf_counter() - started
+    write_report({
+        'commit': git_commit(),
+        'label': args.label,
+        'config': {
+            'samples': args.samples,
+            'baseline_samples': args.baseline_samples,
+            'exclude': args.exclude,
+            'per_category': args.per_category,
+            'categories': CATEGORIES
+        },
+        'duration_s': round(duration, 3),
+        'questions': {str(size): recorder.summary(str(size), duration) for size in args.sizes}
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from run import ROOT, Recorder, git_commit, write_report
+
+sys.path.insert(0, os.path.join(ROOT, 'frontend', 'source'))
+import app as frontend  # noqa: E402
+from game import Game  # noqa: E402
+from utils import settings  # noqa: E402
+
+
+class QuestionsHandler(BaseHTTPRequestHandler):
+    # Stands in for the backend's questions/ endpoint, set by serve_questions()
+    latency = 0.0
+
+    def do_GET(self):
+        if not urlparse(self.path).path.startswith('/questions/'):
+            self.send_error(404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        payload = json.dumps({
+            'question': 'Benchmark question?',
+            'answers': ['Right', 'Wrong 1', 'Wrong 2', 'Wrong 3'],
+            'correct_answer': 0
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QuestionsServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room threads connect all at once, a short accept backlog costs them a
+    # second long SYN retry
+    request_queue_size = 128
+
+
+def serve_questions(latency):
+    # Listens where the frontend expects the backend, so start_round goes
+    # through the same pooled session as in production
+    QuestionsHandler.latency = latency
+    url = urlparse(settings.BACKEND_URL)
+    server = QuestionsServer((url.hostname, url.port), QuestionsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_rooms(count, rounds):
+    codes = []
+    for _ in range(count):
+        code = f'bench-{uuid.uuid4().hex[:8]}'
+        game = Game(code, 8, 1, rounds, None, None, 'host')
+        game.start()
+        game.commit_to_redis()
+        codes.append(code)
+    return codes
+
+
+def measure(rooms, args, recorder, kind):
+    # Every room plays all its rounds through the frontend's own start_round
+    # and end_round, which hand over to each other until the game ends
+    codes = create_rooms(rooms, args.rounds)
+    ended = {code: threading.Event() for code in codes}
+    start_round = frontend.start_round
+    emit = frontend.socket_app.emit
+
+    def timed_start_round(room, session_id, previous_round):
+        started = time.perf_counter()
+        start_round(room, session_id, previous_round)
+        recorder.record(kind, 'start_round', time.perf_counter() - started)
+
+    def record_end(event, *args, to=None, **kwargs):
+        if event == 'game/end':
+            ended[to].set()
+        return emit(event, *args, to=to, **kwargs)
+
+    frontend.start_round = timed_start_round
+    frontend.socket_app.emit = record_end
+    try:
+        started = time.perf_counter()
+        for code in codes:
+            frontend.socket_app.start_background_task(frontend.start_round, code, 'bench', 0)
+        for code in codes:
+            if not ended[code].wait(args.timeout):
+                raise RuntimeError(f'{kind}: room {code} did not finish its rounds')
+        duration = time.perf_counter() - started
+    finally:
+        frontend.start_round = start_round
+        frontend.socket_app.emit = emit
+        for code in codes:
+            Game.delete_game_from_redis(code)
+
+    summary = recorder.summary(kind, duration)['start_round']
+    return {
+        'rounds_per_second': round(rooms * args.rounds / duration, 1),
+        'start_round_p50_ms': summary['p50_ms'],
+        'start_round_p99_ms': summary['p99_ms']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Game state throughput as the number of concurrently played rooms grows')
+    parser.add_argument('--rooms', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--rounds', type=int, default=50, help='rounds played per room')
+    parser.add_argument('--backend-ms', type=float, default=5.0, help='latency of the backend\'s questions/ endpoint')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--label', help='free form label stored with the results')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    # Rounds follow each other with no time to answer or look at the results,
+    # so the rounds per second only depend on the round handlers
+    frontend.ROUND_SECONDS = 0
+    frontend.REVEAL_SECONDS = 0
+    frontend.ANSWER_GRACE_SECONDS = 0
+    server = serve_questions(args.backend_ms / 1000)
+
+    # The process wide lock every game used to share, taken by the same
+    # handlers in place of the per game Redis lock
+    game_lock = Game.__dict__['lock']
+    global_lock = threading.Lock()
+    recorder = Recorder()
+    results = {'per_game_lock': {}, 'global_lock': {}}
+    try:
+        for rooms in args.rooms:
+            results['per_game_lock'][str(rooms)] = measure(rooms, args, recorder, f'per_game/{rooms}')
+            Game.lock = staticmethod(lambda joining_code: global_lock)
+            try:
+                results['global_lock'][str(rooms)] = measure(rooms, args, recorder, f'global/{rooms}')
+            finally:
+                Game.lock = game_lock
+    finally:
+        server.shutdown()
+
+    write_report({
+        'commit': git_commit(),
+        'label': args.label,
+        'config': {'rounds': args.rounds, 'backend_ms': args.backend_ms},
+        **results
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
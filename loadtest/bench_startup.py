@@ -0,0 +1,115 @@
+import argparse
+import time
+import backend_env
+from sqlalchemy import text
+from db import engine
+from game import endpoints as game_endpoints, models as game_models
+from users import endpoints as user_endpoints, models as user_models
+from users.session import redis
+from run import Recorder, git_commit, write_report
+
+
+async def fill(size, live_every):
+    # Every user logged in and every game active, as after a crash at peak
+    async with engine.begin() as db:
+        await db.execute(text('TRUNCATE users, games, game_players, game_results RESTART IDENTITY CASCADE'))
+        await db.execute(text(
+            "INSERT INTO users (user_name, email, hashed_password, salt, is_active, games_played, games_won) "
+            "SELECT 'bench-startup-' || n, 'bench-startup-' || n || '@bench.invalid', '', '', true, 0, 0 "
+            "FROM generate_series(1, :size) n"
+        ), {'size': size})
+        await db.execute(text(
+            "INSERT INTO games (joining_code, host_id, max_players, player_count, is_started, is_active) "
+            "SELECT 'bench-' || n, n, 8, 1, true, true FROM generate_series(1, :size) n"
+        ), {'size': size})
+        await db.execute(text('ANALYZE users'))
+        await db.execute(text('ANALYZE games'))
+
+    # Sessions for every user, and live state for some of the games
+    async with redis.pipeline(transaction=False) as pipe:
+        for n in range(1, size + 1):
+            pipe.set(f'sessions/bench-{n}', n)
+            if n % live_every == 0:
+                pipe.hset(f'games/bench-{n}', 'joining_code', f'bench-{n}')
+            if n % 10_000 == 0:
+                await pipe.execute()
+        await pipe.execute()
+
+
+async def clear_live_games():
+    async for key in redis.scan_iter(match='games/bench-*', count=1000):
+        await redis.unlink(key)
+
+
+async def old_users_startup():
+    # What users/endpoints.startup did before: KEYS, one DELETE per session and
+    # one UPDATE per active user
+    for key in await redis.keys('sessions/*'):
+        await redis.delete(key)
+    async with engine.begin() as db:
+        active_users = await db.execute(user_models.User.__table__.select().where(user_models.User.is_active == True))
+        for user in active_users.all():
+            await db.execute(
+                user_models.User.__table__.update().where(user_models.User.id == user.id).values(is_active=False)
+            )
+
+
+async def old_games_startup():
+    # And game/endpoints.startup, one UPDATE per active game
+    async with engine.begin() as db:
+        active_games = await db.execute(game_models.Game.__table__.select().where(game_models.Game.is_active == True))
+        games_in_redis = await redis.keys('games/*')
+        for game in active_games.all():
+            if game.joining_code not in games_in_redis:
+                await db.execute(
+                    game_models.Game.__table__.update().where(game_models.Game.id == game.id).values(is_active=False)
+                )
+
+
+async def benchmark(args, recorder):
+    try:
+        for size in args.sizes:
+            kind = str(size)
+            await fill(size, args.live_every)
+            with recorder.timed(kind, 'users_startup'):
+                await user_endpoints.startup()
+            with recorder.timed(kind, 'games_startup'):
+                await game_endpoints.startup()
+            await user_endpoints.shutdown()
+            await game_endpoints.shutdown()
+
+            if size <= args.baseline_up_to:
+                await fill(size, args.live_every)
+                with recorder.timed(kind, 'old_users_startup'):
+                    await old_users_startup()
+                with recorder.timed(kind, 'old_games_startup'):
+                    await old_games_startup()
+            await clear_live_games()
+    finally:
+        await clear_live_games()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backend startup time as the games, users and sessions grow')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 300_000])
+    parser.add_argument('--live-every', type=int, default=100, help='one game in this many still has state in Redis')
+    parser.add_argument('--baseline-up-to', type=int, default=100_000, help='largest size to time the old startup at')
+    parser.add_argument('--label', help='free form label stored with the results')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    backend_env.run(benchmark(args, recorder))
+    duration = time.perf_counter() - started
+    write_report({
+        'commit': git_commit(),
+        'label': args.label,
+        'config': {'live_every': args.live_every, 'baseline_up_to': args.baseline_up_to},
+        'duration_s': round(duration, 3),
+        'rows': {str(size): recorder.summary(str(size), duration) for size in args.sizes}
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
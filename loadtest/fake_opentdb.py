@@ -0,0 +1,82 @@
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+CATEGORIES = [
+    {'id': 9, 'name': 'General Knowledge'},
+    {'id': 17, 'name': 'Science & Nature'},
+    {'id': 23, 'name': 'History'}
+]
+
+
+def make_question(rng, category):
+    number = rng.randrange(1_000_000)
+    return {
+        'category': category['name'],
+        'type': 'multiple',
+        'difficulty': 'medium',
+        'question': f'Load test question {number}?',
+        'correct_answer': f'Right {number}',
+        'incorrect_answers': [f'Wrong {number} {i}' for i in range(3)]
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Set by serve(), so every run answers with the same question stream
+    rng = random.Random(0)
+    latency = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.endswith('api_token.php'):
+            body = {'response_code': 0, 'token': uuid.uuid4().hex}
+        elif url.path.endswith('api_category.php'):
+            body = {'trivia_categories': CATEGORIES}
+        elif url.path.endswith('api.php'):
+            category = next(
+                (category for category in CATEGORIES if str(category['id']) == params.get('category')),
+                CATEGORIES[0]
+            )
+            amount = min(50, int(params.get('amount', 10)))
+            body = {
+                'response_code': 0,
+                'results': [make_question(self.rng, category) for _ in range(amount)]
+            }
+        else:
+            self.send_error(404)
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, latency=0.0, seed=0):
+    Handler.rng = random.Random(seed)
+    Handler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Stand-in for the Open Trivia DB API')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    args = parser.parse_args()
+    serve(args.port, args.latency).serve_forever()
@@ -0,0 +1,479 @@
+import argparse
+import json
+import os
+import queue
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import requests
+import socketio
+from fake_opentdb import serve as serve_opentdb
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_URL = 'http://localhost:8000'
+SOCKET_EVENTS = (
+    'lobby/players',
+    'lobby/game-started',
+    'lobby/game-cancelled',
+    'game/start',
+    'game/question',
+    'game/round-end',
+    'game/scores',
+    'game/end'
+)
+
+
+class LoadTestError(Exception):
+    pass
+
+
+def percentile(samples, fraction):
+    # Nearest rank, samples must already be sorted
+    if not samples:
+        return None
+    index = max(0, min(len(samples) - 1, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.backend_calls = defaultdict(int)
+
+    def record(self, kind, name, seconds, ok=True, backend_calls=0):
+        with self.lock:
+            self.samples[(kind, name)].append(seconds)
+            self.requests[(kind, name)] += 1
+            self.backend_calls[(kind, name)] += backend_calls
+            if not ok:
+                self.errors[(kind, name)] += 1
+
+    def error(self, kind, name):
+        with self.lock:
+            # Failed before a timing was available, counted but not timed
+            self.samples[(kind, name)]
+            self.requests[(kind, name)] += 1
+            self.errors[(kind, name)] += 1
+
+    @contextmanager
+    def timed(self, kind, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record(kind, name, time.perf_counter() - start, ok=False)
+            raise
+        self.record(kind, name, time.perf_counter() - start)
+
+    def summary(self, kind, duration):
+        results = {}
+        for (sample_kind, name), samples in sorted(self.samples.items()):
+            if sample_kind != kind:
+                continue
+            samples = sorted(samples)
+            count = self.requests[(kind, name)]
+            results[name] = {
+                'count': count,
+                'errors': self.errors[(kind, name)],
+                'error_rate': self.errors[(kind, name)] / count if count else 1.0,
+                'per_second': count / duration,
+                'p50_ms': _ms(percentile(samples, 0.50)),
+                'p95_ms': _ms(percentile(samples, 0.95)),
+                'p99_ms': _ms(percentile(samples, 0.99)),
+                'max_ms': _ms(samples[-1] if samples else None)
+            }
+            if kind == 'http':
+                results[name]['backend_calls_per_request'] = (
+                    self.backend_calls[(kind, name)] / len(samples) if samples else None
+                )
+        return results
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class Room:
+    def __init__(self, size):
+        self.joining_code = None
+        self.created = threading.Event()
+        self.barrier = threading.Barrier(size)
+
+
+class Player:
+    def __init__(self, frontend_url, recorder, name, timeout):
+        self.frontend_url = frontend_url
+        self.recorder = recorder
+        self.name = name
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.sio = socketio.Client(reconnection=False)
+        self.inbox = defaultdict(queue.Queue)
+        for event in SOCKET_EVENTS:
+            self.sio.on(event, self._receiver(event))
+
+    def _receiver(self, event):
+        def receive(data=None):
+            self.inbox[event].put((time.perf_counter(), data))
+        return receive
+
+    def request(self, name, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.http.request(
+                method, self.frontend_url + path, allow_redirects=False, timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException:
+            self.recorder.error('http', name)
+            raise
+        self.recorder.record(
+            'http',
+            name,
+            time.perf_counter() - start,
+            ok=response.status_code < 400,
+            backend_calls=int(response.headers.get('X-Backend-Calls', 0))
+        )
+        return response
+
+    def connect(self):
+        cookies = '; '.join(f'{cookie.name}={cookie.value}' for cookie in self.http.cookies)
+        with self.recorder.timed('socket', 'connect'):
+            self.sio.connect(
+                self.frontend_url,
+                headers={'Cookie': cookies},
+                transports=['websocket'],
+                wait_timeout=self.timeout
+            )
+
+    def expect(self, *events, timeout=None):
+        # Waits for the first of the given events, returns (event, received_at, data)
+        deadline = time.perf_counter() + (timeout or self.timeout)
+        while time.perf_counter() < deadline:
+            for event in events:
+                try:
+                    received_at, data = self.inbox[event].get_nowait()
+                    return event, received_at, data
+                except queue.Empty:
+                    pass
+            time.sleep(0.005)
+        raise LoadTestError(f'{self.name} timed out waiting for {events}')
+
+    def call(self, event, data, reply, name=None):
+        name = name or event
+        sent_at = time.perf_counter()
+        self.sio.emit(event, data)
+        try:
+            _, received_at, data = self.expect(reply)
+        except LoadTestError:
+            self.recorder.error('socket', name)
+            raise
+        self.recorder.record('socket', name, received_at - sent_at)
+        return data
+
+
+def enter_game(player, room, is_host, args):
+    # Everything up to the game room, returns the joining code
+    password = uuid.uuid4().hex
+    player.request('register', 'post', '/register', data={
+        'user_name': player.name,
+        'email': f'{player.name}@loadtest.invalid',
+        'password': password
+    })
+    player.request('login', 'post', '/login', data={'user_name': player.name, 'password': password})
+
+    if is_host:
+        player.request('create_game_page', 'get', '/create-game')
+        response = player.request('create_game', 'post', '/create-game', data={
+            'selected_categories': 'any',
+            'difficulty': 'any',
+            'number_of_questions': args.questions,
+            'max_players': args.players
+        })
+        match = re.search(r'/game/([^/]+)/lobby', response.headers.get('Location', ''))
+        if match is None:
+            raise LoadTestError(f'{player.name} could not create a game')
+        room.joining_code = match.group(1)
+        room.created.set()
+    else:
+        if not room.created.wait(player.timeout):
+            raise LoadTestError(f'{player.name} timed out waiting for the game')
+        player.request('join_game', 'post', '/join-game', data={'joining_code': room.joining_code})
+    code = room.joining_code
+
+    player.request('game_lobby', 'get', f'/game/{code}/lobby')
+    player.connect()
+    player.call('lobby/join', {'joining_code': code}, 'lobby/players')
+    room.barrier.wait(player.timeout)
+
+    if is_host:
+        player.call('lobby/start-game', {'joining_code': code}, 'lobby/game-started')
+    else:
+        player.expect('lobby/game-started')
+
+    player.request('game_room', 'get', f'/game/{code}/game-room')
+    player.call('game/join', {'joining_code': code}, 'game/start')
+    return code
+
+
+def play(player, room, is_host, args):
+    code = enter_game(player, room, is_host, args)
+    if is_host:
+        player.sio.emit('game/next-question', {'joining_code': code})
+
+    rounds = 0
+    while True:
+        event, received_at, question = player.expect('game/question', 'game/end', timeout=player.timeout * 2)
+        if event == 'game/end':
+            break
+        rounds += 1
+        time.sleep(random.uniform(0, args.round_seconds * args.answer_fraction))
+        player.sio.emit('game/answer', {'joining_code': code, 'answer': random.choice(question['answers'])})
+
+        # How late the server's deadline broadcast arrives, relative to the
+        # deadline the client was told about
+        _, ended_at, _ = player.expect('game/round-end', timeout=player.timeout + question['seconds'])
+        player.recorder.record('socket', 'game/round-end-lag', ended_at - received_at - question['seconds'])
+        player.call('game/request-scores', {'joining_code': code}, 'game/scores')
+
+    if rounds != args.questions:
+        raise LoadTestError(f'{player.name} played {rounds} of {args.questions} rounds')
+
+    # The host's results request ends the game on the backend, so it goes first
+    room.barrier.wait(player.timeout)
+    if is_host:
+        player.request('game_results', 'get', f'/game/{code}/results')
+    room.barrier.wait(player.timeout)
+    if not is_host:
+        player.request('game_results', 'get', f'/game/{code}/results')
+    player.sio.disconnect()
+    return rounds
+
+
+def frontend_urls(args):
+    # Separate frontend processes listen on consecutive ports
+    url = urlparse(args.frontend_url)
+    return [f'{url.scheme}://{url.hostname}:{url.port + number}' for number in range(args.frontend_processes)]
+
+
+def run_room(index, args, recorder, run_id, outcomes):
+    # Players alternate between the frontend processes, so with more than one
+    # every room spans processes and its broadcasts must cross the message queue
+    room = Room(args.players)
+    urls = frontend_urls(args)
+    players = [
+        Player(urls[number % len(urls)], recorder, f'load-{run_id}-{index}-{number}', args.timeout)
+        for number in range(args.players)
+    ]
+
+    def run_player(player, is_host):
+        try:
+            rounds = play(player, room, is_host, args)
+            outcomes.put(('ok', rounds))
+        except Exception as error:
+            room.barrier.abort()
+            room.created.set()
+            outcomes.put(('error', f'{player.name}: {error!r}'))
+            try:
+                player.sio.disconnect()
+            except Exception:
+                pass
+
+    threads = [
+        threading.Thread(target=run_player, args=(player, number == 0), daemon=True)
+        for number, player in enumerate(players)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def wait_for(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.25)
+    raise LoadTestError(f'{url} did not come up within {timeout}s')
+
+
+def start_servers(args):
+    opentdb = serve_opentdb(args.opentdb_port, latency=args.opentdb_latency)
+    threading.Thread(target=opentdb.serve_forever, daemon=True).start()
+
+    env = dict(os.environ)
+    env['OPEN_TRIVIA_URL'] = f'http://127.0.0.1:{args.opentdb_port}/'
+    env['ROUND_SECONDS'] = str(args.round_seconds)
+    env['REVEAL_SECONDS'] = str(args.reveal_seconds)
+    env['SOCKETIO_ASYNC_MODE'] = 'gevent'
+    if args.frontend_workers > 1 or args.frontend_processes > 1:
+        env.setdefault('SOCKETIO_MESSAGE_QUEUE', 'redis://localhost:6379/0')
+
+    log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+    processes = [
+        subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'app:app', '--port', '8000', '--workers', str(args.backend_workers)],
+            cwd=os.path.join(ROOT, 'backend', 'source'),
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT
+        )
+    ]
+    for url in frontend_urls(args):
+        processes.append(subprocess.Popen(
+            [
+                sys.executable, '-m', 'gunicorn', 'app:app',
+                '--bind', url.split('//', 1)[1],
+                '--workers', str(args.frontend_workers),
+                '-k', 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+            ],
+            cwd=os.path.join(ROOT, 'frontend', 'source'),
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT
+        ))
+    try:
+        wait_for(f'{BACKEND_URL}/docs', args.startup_timeout)
+        for url in frontend_urls(args):
+            wait_for(url, args.startup_timeout)
+    except LoadTestError:
+        stop_servers(opentdb, processes)
+        raise
+    return opentdb, processes
+
+
+def stop_servers(opentdb, processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    opentdb.shutdown()
+    opentdb.server_close()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    recorder = Recorder()
+    outcomes = queue.Queue()
+    run_id = uuid.uuid4().hex[:8]
+    random.seed(args.seed)
+
+    started = time.perf_counter()
+    rooms = []
+    for index in range(args.rooms):
+        thread = threading.Thread(target=run_room, args=(index, args, recorder, run_id, outcomes), daemon=True)
+        thread.start()
+        rooms.append(thread)
+        time.sleep(args.ramp_up / max(1, args.rooms))
+    for thread in rooms:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    outcomes = [outcomes.get() for _ in range(outcomes.qsize())]
+    failures = [detail for status, detail in outcomes if status == 'error']
+    http = recorder.summary('http', duration)
+    events = recorder.summary('socket', duration)
+    return {
+        'commit': git_commit(),
+        'label': args.label,
+        'config': {
+            'rooms': args.rooms,
+            'players': args.players,
+            'questions': args.questions,
+            'round_seconds': args.round_seconds,
+            'reveal_seconds': args.reveal_seconds,
+            'frontend_workers': args.frontend_workers,
+            'frontend_processes': args.frontend_processes,
+            'backend_workers': args.backend_workers,
+            'opentdb_latency': args.opentdb_latency
+        },
+        'duration_s': round(duration, 3),
+        'players_finished': len(outcomes) - len(failures),
+        'players_failed': len(failures),
+        'failures': failures[:20],
+        'throughput': {
+            'http_requests_per_second': sum(entry['count'] for entry in http.values()) / duration,
+            'socket_events_per_second': sum(entry['count'] for entry in events.values()) / duration
+        },
+        'http': http,
+        'socket': events
+    }
+
+
+def write_report(report, path=None):
+    output = json.dumps(report, indent=2)
+    if path:
+        with open(path, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Plays concurrent dTrivia games end to end and reports latencies')
+    parser.add_argument('--rooms', type=int, default=4, help='concurrent games')
+    parser.add_argument('--players', type=int, default=4, help='players per game, including the host')
+    parser.add_argument('--questions', type=int, default=3)
+    parser.add_argument('--round-seconds', type=int, default=3)
+    parser.add_argument('--reveal-seconds', type=int, default=1)
+    parser.add_argument('--answer-fraction', type=float, default=0.8, help='answers arrive within this fraction of a round')
+    parser.add_argument('--ramp-up', type=float, default=1.0, help='seconds over which rooms are started')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frontend-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--start', action='store_true', help='start the backend, frontend and a fake Open Trivia DB')
+    parser.add_argument('--frontend-workers', type=int, default=1)
+    parser.add_argument(
+        '--frontend-processes',
+        type=int,
+        default=1,
+        help='separate frontend processes on consecutive ports, every room spans all of them'
+    )
+    parser.add_argument('--backend-workers', type=int, default=1)
+    parser.add_argument('--opentdb-port', type=int, default=8099)
+    parser.add_argument('--opentdb-latency', type=float, default=0.0)
+    parser.add_argument('--startup-timeout', type=float, default=30.0)
+    parser.add_argument('--server-log', help='file for the started servers\' output')
+    parser.add_argument('--label', help='free form label stored with the results')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    servers = start_servers(args) if args.start else None
+    try:
+        report = run(args)
+    finally:
+        if servers:
+            stop_servers(*servers)
+
+    write_report(report, args.output)
+    sys.exit(1 if report['players_failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
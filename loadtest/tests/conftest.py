@@ -0,0 +1,21 @@
+import os
+import socket
+import sys
+import pytest
+
+
+# The tests start the backend, the frontend and the fake Open Trivia DB
+# themselves, Postgres and Redis have to be running on localhost
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _reachable(port: int) -> bool:
+    try:
+        socket.create_connection(('localhost', port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+if not (_reachable(5432) and _reachable(6379)):
+    pytest.skip('Postgres and Redis need to be running on localhost', allow_module_level=True)
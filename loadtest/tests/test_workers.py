@@ -0,0 +1,35 @@
+import run
+
+
+ROOMS = 2
+PLAYERS = 4
+QUESTIONS = 2
+
+
+def test_rooms_spanning_frontend_processes_get_every_broadcast():
+    # Every room has players on both processes, so each question and round
+    # end reaches half of them only through the Redis message queue
+    args = run.parse_args([
+        '--start',
+        '--frontend-processes', '2',
+        '--frontend-url', 'http://127.0.0.1:5100',
+        '--opentdb-port', '8199',
+        '--rooms', str(ROOMS),
+        '--players', str(PLAYERS),
+        '--questions', str(QUESTIONS),
+        '--round-seconds', '1',
+        '--reveal-seconds', '1',
+        '--timeout', '20'
+    ])
+    servers = run.start_servers(args)
+    try:
+        report = run.run(args)
+    finally:
+        run.stop_servers(*servers)
+
+    assert report['failures'] == []
+    assert report['players_finished'] == ROOMS * PLAYERS
+    rounds = ROOMS * PLAYERS * QUESTIONS
+    assert report['socket']['game/round-end-lag']['count'] == rounds
+    assert report['socket']['game/request-scores']['count'] == rounds
+    assert report['socket']['game/request-scores']['errors'] == 0